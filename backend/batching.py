@@ -0,0 +1,134 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+
+class AsyncBatcher:
+    """Coalesces items submitted concurrently into batches for a single downstream call.
+
+    Callers `await process(item)`. A background task collects items until either
+    `max_batch_size` items are queued or `max_queue_time` seconds have passed since
+    the first item of the batch arrived, then hands the whole batch to
+    `process_batch`, which must return one result per item, in order. A result
+    that is an exception fails only that item's caller.
+
+    When `max_batch_weight` is set, a batch also closes before the summed
+    `item_weight` of its items would exceed it (e.g. to bound the payload bytes of
+    one request); an item heavier than the limit is sent on its own.
+    """
+
+    def __init__(
+            self,
+            process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+            max_batch_size: int = 16,
+            max_queue_time: float = 0.02,
+            item_weight: Optional[Callable[[Any], int]] = None,
+            max_batch_weight: Optional[int] = None
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_queue_time = max_queue_time
+        self.item_weight = item_weight
+        self.max_batch_weight = max_batch_weight
+        self._queue: asyncio.Queue[Tuple[Any, asyncio.Future]] = asyncio.Queue()
+        # An item that did not fit in the previous batch; it starts the next one
+        self._carried_over: Optional[Tuple[Any, asyncio.Future]] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        self._batch_tasks: set = set()
+
+    def start(self) -> None:
+        """Starts the background task that drains the queue into batches."""
+        if self._worker_task is None:
+            self._worker_task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Stops the background task and fails any items still waiting in the queue.
+
+        Batches already dispatched get up to `timeout` seconds to finish and are
+        then cancelled, so none of them outlive the clients they use.
+        """
+        if self._worker_task is not None:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        waiting = [self._carried_over] if self._carried_over is not None else []
+        self._carried_over = None
+        while not self._queue.empty():
+            waiting.append(self._queue.get_nowait())
+        for _, future in waiting:
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped before the item was processed."))
+
+        if self._batch_tasks:
+            _, unfinished = await asyncio.wait(set(self._batch_tasks), timeout=timeout)
+            for batch_task in unfinished:
+                batch_task.cancel()
+            if unfinished:
+                await asyncio.wait(unfinished)
+
+    async def process(self, item: Any) -> Any:
+        """Queues an item for the next batch and waits for its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._carried_over is not None:
+                batch, self._carried_over = [self._carried_over], None
+            else:
+                batch = [await self._queue.get()]
+            batch_weight = self._weight(batch[0])
+            deadline = loop.time() + self.max_queue_time
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                entry_weight = self._weight(entry)
+                if self.max_batch_weight is not None and batch_weight + entry_weight > self.max_batch_weight:
+                    self._carried_over = entry
+                    break
+                batch.append(entry)
+                batch_weight += entry_weight
+
+            # Dispatch without awaiting so the next batch can fill while this one is in flight.
+            batch_task = asyncio.create_task(self._dispatch(batch))
+            self._batch_tasks.add(batch_task)
+            batch_task.add_done_callback(self._batch_tasks.discard)
+
+    def _weight(self, entry: Tuple[Any, asyncio.Future]) -> int:
+        return self.item_weight(entry[0]) if self.item_weight is not None else 0
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Batch returned {len(results)} results for {len(batch)} items.")
+        except asyncio.CancelledError:
+            # Cancelled by `stop`; release the callers instead of leaving them waiting
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Batcher stopped before the batch finished."))
+            raise
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, asyncio.CancelledError):
+                future.cancel()
+            elif isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
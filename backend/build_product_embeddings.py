@@ -0,0 +1,100 @@
+"""Precomputes product embeddings for the image-matching index with a Gemini Batch Mode job.
+
+Batch embedding is billed at half the interactive price, so the catalog is embedded
+here once (and again whenever products change) instead of on every deploy. The
+backend loads the result from `settings.product_embeddings_path` at startup and
+only embeds products that are missing or changed since the last run.
+
+Usage (from the `backend/` directory):
+    python build_product_embeddings.py
+"""
+import io
+import json
+import logging
+import time
+
+from google import genai
+from google.genai import types as genai_types
+
+from config import settings
+from product_index import product_embedding_text, normalize_embeddings, save_product_embeddings
+from utils import load_products_from_file
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = 30
+COMPLETED_JOB_STATES = {
+    genai_types.JobState.JOB_STATE_SUCCEEDED,
+    genai_types.JobState.JOB_STATE_FAILED,
+    genai_types.JobState.JOB_STATE_CANCELLED,
+    genai_types.JobState.JOB_STATE_EXPIRED,
+}
+
+
+def main() -> None:
+    logging.basicConfig(level=settings.log_level, format="%(levelname)s: %(message)s")
+    products = [p for p in load_products_from_file(settings.products_json_path) if p.get("id")]
+    if not products:
+        logger.error("No products to embed.")
+        return
+
+    gemini_client = genai.Client(api_key=settings.gemini_api_key)
+    jsonl_lines = [
+        json.dumps({
+            "key": p["id"],
+            "request": {
+                "task_type": "RETRIEVAL_DOCUMENT",
+                "output_dimensionality": settings.embedding_dimensionality,
+                "content": {"parts": [{"text": product_embedding_text(p)}]}
+            }
+        })
+        for p in products
+    ]
+    uploaded_file = gemini_client.files.upload(
+        file=io.BytesIO("\n".join(jsonl_lines).encode("utf-8")),
+        config=genai_types.UploadFileConfig(display_name="product-embeddings", mime_type="jsonl")
+    )
+    batch_job = gemini_client.batches.create_embeddings(
+        model=settings.embedding_model_name,
+        src=genai_types.EmbeddingsBatchJobSource(file_name=uploaded_file.name),
+        config=genai_types.CreateEmbeddingsBatchJobConfig(display_name="product-embeddings")
+    )
+    logger.info("Submitted embedding batch job %s for %s products.", batch_job.name, len(products))
+
+    while batch_job.state not in COMPLETED_JOB_STATES:
+        time.sleep(POLL_INTERVAL_SECONDS)
+        batch_job = gemini_client.batches.get(name=batch_job.name)
+        logger.info("Batch job %s is %s.", batch_job.name, batch_job.state.value)
+
+    if batch_job.state != genai_types.JobState.JOB_STATE_SUCCEEDED:
+        logger.error("Batch job %s finished as %s: %s", batch_job.name, batch_job.state.value, batch_job.error)
+        return
+
+    results_bytes = gemini_client.files.download(file=batch_job.dest.file_name)
+    vectors_by_id = {}
+    for line in results_bytes.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        if "response" not in result:
+            logger.error("Embedding request %s failed: %s", result.get('key'), result.get('error'))
+            continue
+        response = genai_types.SingleEmbedContentResponse.model_validate(result["response"])
+        vectors_by_id[result["key"]] = response.embedding.values
+
+    embedded_products = [p for p in products if p["id"] in vectors_by_id]
+    save_product_embeddings(
+        settings.product_embeddings_path,
+        embedded_products,
+        normalize_embeddings([vectors_by_id[p["id"]] for p in embedded_products]),
+        settings.embedding_model_name,
+        settings.embedding_dimensionality
+    )
+    logger.info(
+        "Saved %s of %s product embeddings to %s.",
+        len(embedded_products), len(products), settings.product_embeddings_path
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
+import logging
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+logger = logging.getLogger(__name__)
+
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 
 class AppSettings(BaseSettings):
@@ -12,13 +15,109 @@ class AppSettings(BaseSettings):
     # File paths
     products_json_path: Path = PROJECT_ROOT / "productinfo" / "products.json"
     products_image_path: Path = PROJECT_ROOT / "productinfo" / "images"
+    product_embeddings_path: Path = PROJECT_ROOT / "productinfo" / "product_embeddings.npz"
+
+    # Server settings used when launching with `python main.py`. WEB_CONCURRENCY sets the
+    # worker count; more than one worker needs redis_url, since in-memory sessions are per process
+    server_host: str = "0.0.0.0"
+    server_port: int = 8086
+    web_concurrency: int = 1
+    server_backlog: int = 4096
+    server_keepalive_timeout_seconds: int = 30
+
+    # Minimum level of application log messages (e.g. "DEBUG", "INFO", "WARNING")
+    log_level: str = "INFO"
 
     # CORS settings
     allowed_origins: List[str] = ["http://localhost:3000", "http://localhost:5173"]
+    allowed_methods: List[str] = ["GET", "POST", "OPTIONS"]
+    allowed_headers: List[str] = ["Content-Type", "Authorization"]
 
     # Application specific settings
     max_history_turns: int = 10
     default_user_profile: Dict[str, str] = {"profile": "valued customer"}
+    session_max_count: int = 10000
+    session_ttl_seconds: int = 3600
+
+    # Shared session storage; when set, chat histories are kept in Redis so
+    # sessions survive across multiple uvicorn workers
+    redis_url: Optional[str] = None
+    redis_max_connections: int = 100
+    # Concurrent messages to the same session wait for the previous turn to finish
+    session_lock_timeout_seconds: float = 120
+    session_lock_wait_seconds: float = 30
+    reco_cache_max_size: int = 1024
+    reco_cache_ttl_seconds: int = 3600
+    # Paraphrased text queries reuse a cached result when their embeddings are at
+    # least this similar; costs one embedding call per exact-cache miss
+    semantic_cache_enabled: bool = True
+    semantic_cache_max_size: int = 1024
+    semantic_cache_similarity_threshold: float = 0.92
+    max_batch_recommendation_queries: int = 1000
+    max_image_bytes: int = 10 * 1024 * 1024
+    # Uploads must declare one of these types and start with a matching image signature
+    allowed_image_mime_types: List[str] = ["image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"]
+    # Product descriptions are truncated to this length in LLM prompts to save tokens
+    product_description_max_chars: int = 160
+    # Concurrent text recommendation queries are coalesced into one Gemini call;
+    # set reco_batch_max_size to 1 to send every query on its own
+    reco_batch_max_size: int = 16
+    reco_batch_max_wait_ms: int = 20
+    # Concurrent image uploads are described together in one vision model call when
+    # images are matched against the product index; set image_batch_max_size to 1 to disable
+    image_batch_max_size: int = 8
+    image_batch_max_wait_ms: int = 20
+    # Total image bytes sent inline in one batched call; Gemini caps inline requests
+    # at 20 MB and base64 encoding grows images by a third
+    image_batch_max_bytes: int = 14 * 1024 * 1024
+
+    # Worker threads for CPU-bound work offloaded from the event loop; unset uses min(32, 2 x CPUs)
+    default_executor_max_workers: Optional[int] = None
+
+    # Gemini client settings
+    gemini_request_timeout_ms: int = 60000
+    # Connection pool for async Gemini calls; size it for the expected request concurrency
+    gemini_max_connections: int = 200
+    gemini_keepalive_timeout_seconds: float = 60
+    # Upper bound on in-flight Gemini operations per worker; further requests wait for a free slot
+    gemini_max_concurrency: int = 32
+    # Requests failing with 408, 429 or 5xx are retried with exponential backoff;
+    # attempts includes the first try, so 1 disables retries
+    gemini_retry_attempts: int = 4
+    gemini_retry_initial_delay_seconds: float = 1.0
+    gemini_retry_max_delay_seconds: float = 20.0
+    # Optional Gemini service tiers ("priority", "standard" or "flex"); unset uses the default tier
+    chat_service_tier: Optional[str] = None
+    recommendation_service_tier: Optional[str] = None
+
+    # Gemini context caching for the static product catalog
+    catalog_cache_enabled: bool = True
+    catalog_cache_ttl_seconds: int = 3600
+    catalog_cache_refresh_margin_seconds: int = 60
+
+    # Local FAISS index of product embeddings; when it is available, image
+    # descriptions are matched against it instead of sending the catalog to Gemini
+    product_index_enabled: bool = True
+    embedding_model_name: str = "gemini-embedding-001"
+    embedding_dimensionality: int = 768
+    image_match_top_k: int = 3
+    # Catalogs larger than this send only the nearest products to the LLM for text queries
+    text_retrieval_top_k: int = 20
+    # Minimum cosine similarity for an image match. Gemini embeddings of unrelated texts
+    # still score well above 0, so this must sit near the related/unrelated boundary;
+    # raise it to drop weak matches, lower it if real matches are being missed
+    image_match_min_score: float = 0.55
+    # "flat" searches every vector exactly; "ivfpq" compresses vectors with product
+    # quantization for very large catalogs (needs tens of thousands of products to train);
+    # "hnsw" uses a navigable graph for sub-linear search over uncompressed vectors
+    product_index_type: str = "flat"
+    product_index_nlist: int = 1024
+    product_index_pq_m: int = 16
+    product_index_pq_nbits: int = 8
+    product_index_nprobe: int = 16
+    product_index_hnsw_m: int = 32
+    product_index_ef_construction: int = 40
+    product_index_ef_search: int = 64
 
     # Model names
     chat_model_name: str = "gemini-1.5-flash"
@@ -38,20 +137,41 @@ Your primary functions are:
 When a user asks what you can do, clearly state these three capabilities.
 Always respond conversationally.
 Maintain context from previous messages.
-Start the conversation by introducing yourself and asking how I (the user) can be helped. This should be your very first response.
 """
 
+    # Rufus's first message in every session; it is returned without calling Gemini
+    rufus_greeting: str = (
+        "Hi, I'm Rufus, your shopping assistant! I can chat about our products, recommend products "
+        "that match a description, or find products similar to a photo you share. How can I help you today?"
+    )
+
     text_recommendation_prompt_template: str = """You are a product recommendation engine for an e-commerce site.
 User query: "{user_query}"
-Available products (summary - use ONLY these for recommendations):
+Available products (summary, one per line as id|name|description|tags - use ONLY these for recommendations):
 {product_context}
 
 Based *only* on the user query and the provided product list, identify up to 3 relevant product IDs that best match the user's query.
-If no products from the list are a good match, respond with "NOMATCH".
-Otherwise, return only a comma-separated list of product IDs (e.g., "prod101,prod205").
-Do not add any other text or explanation. Your response must be ONLY the IDs or NOMATCH.
+Respond with a JSON array of those product IDs (e.g., ["prod101", "prod205"]).
+If no products from the list are a good match, respond with an empty array.
+"""
+
+    batch_text_recommendation_prompt_template: str = """You are a product recommendation engine for an e-commerce site.
+Several users sent the following numbered queries:
+{user_queries}
+Available products (summary, one per line as id|name|description|tags - use ONLY these for recommendations):
+{product_context}
+
+For each query, based *only* on that query and the provided product list, identify up to 3 relevant product IDs that best match it.
+Respond with one entry per query number, giving that query's product IDs.
+Use an empty list of product IDs for a query when no products from the list are a good match.
 """
 
+    catalog_cache_prompt_template: str = """Product catalog for the e-commerce site. Each line is one product, formatted as id|name|description|tags:
+{product_context}
+"""
+
+    cached_product_context_reference: str = "(see the product catalog provided in the cached context)"
+
     image_to_text_prompt: str = """Describe the main product visible in this image.
 Focus on its category, type, color, and key features suitable for an e-commerce search query.
 For example: 'red cotton t-shirt for sports' or 'black wireless headphones'.
@@ -59,14 +179,23 @@ Provide only the description. Do not add any preamble.
 If you cannot identify a product, respond with 'CANNOT IDENTIFY'.
 """
 
-    text_reco_from_image_prompt_template: str = """You are a product recommendation engine.
-An AI vision model described the main product in an image as: "{image_description}"
-Available products (summary - use ONLY these for recommendations):
+    batch_image_to_text_prompt: str = """Describe the main product visible in each of the attached images.
+The images are numbered in the order they are attached, starting at 1.
+Focus on each product's category, type, color, and key features suitable for an e-commerce search query.
+For example: 'red cotton t-shirt for sports' or 'black wireless headphones'.
+Respond with one entry per image number, giving only that image's description.
+If you cannot identify a product in an image, use 'CANNOT IDENTIFY' as its description.
+"""
+
+    image_recommendation_prompt_template: str = """You are a product recommendation engine for an e-commerce site.
+Look at the main product visible in the attached image.
+Available products (summary, one per line as id|name|description|tags - use ONLY these for recommendations):
 {product_context}
-Based *only* on the AI's image description and the provided product list, identify up to 3 relevant product IDs.
-If no products match, respond with "NOMATCH".
-Otherwise, return only a comma-separated list of product IDs (e.g., "prod101,prod205").
-No other text or explanation.
+
+Respond with:
+- description: a short description of the main product in the image, focusing on its category, type, color, and key features (e.g., 'red cotton t-shirt for sports').
+- product_ids: based *only* on the image and the provided product list, up to 3 relevant product IDs, or an empty list if no products match.
+If you cannot identify a product in the image, respond with an empty description and an empty list of product IDs.
 """
 
     model_config = SettingsConfigDict(
@@ -78,4 +207,4 @@ No other text or explanation.
 settings = AppSettings()
 
 if not settings.gemini_api_key:
-    print("CRITICAL: GEMINI_API_KEY not found. Please check your.env file or environment variables.")
\ No newline at end of file
+    logger.critical("GEMINI_API_KEY not found. Please check your.env file or environment variables.")
\ No newline at end of file
@@ -0,0 +1,69 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable
+
+LOG_FORMAT = "%(levelname)s: %(message)s"
+
+# Loggers that uvicorn configures with its own non-propagating stream handlers
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.access")
+
+
+class _PassThroughQueueHandler(QueueHandler):
+    """Enqueues records unformatted, so handlers whose formatters read `record.args`
+    (like uvicorn's access log formatter) still work on the listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def start_queue_logging(level: str = "INFO") -> QueueListener:
+    """Routes application log records through a queue drained by a background thread.
+
+    Request handlers only enqueue records, so writing log output to a slow stream
+    never blocks the event loop. Call `stop()` on the returned listener at
+    shutdown to flush the remaining records.
+    """
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root_logger = logging.getLogger()
+    for handler in [h for h in root_logger.handlers if isinstance(h, QueueHandler)]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def queue_logger_handlers(logger_name: str) -> Callable[[], None]:
+    """Moves the handlers of a non-propagating logger (e.g. uvicorn's access log)
+    behind a queue drained by a background thread, keeping their formatting.
+
+    Returns:
+        A function that flushes the queue and restores the original handlers, so
+        records logged after the application shuts down are still written.
+    """
+    target_logger = logging.getLogger(logger_name)
+    handlers = list(target_logger.handlers)
+    if not handlers:
+        return lambda: None
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _PassThroughQueueHandler(log_queue)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    for handler in handlers:
+        target_logger.removeHandler(handler)
+    target_logger.addHandler(queue_handler)
+
+    def restore() -> None:
+        for handler in handlers:
+            target_logger.addHandler(handler)
+        target_logger.removeHandler(queue_handler)
+        listener.stop()
+
+    return restore
@@ -1,66 +1,509 @@
+import asyncio
+import logging
+import os
 import uuid
-from contextlib import asynccontextmanager
-from typing import List, Dict
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, AsyncExitStack
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from typing import List, Dict, Optional, Tuple, Union
+
+import aiohttp
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from fastapi import BackgroundTasks, FastAPI, HTTPException, UploadFile, File, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from google import genai
+from google.genai import types as genai_types
+from google.genai.chats import AsyncChat
 from fastapi.staticfiles import StaticFiles
 
 from config import settings
 from schema import (
     StartSessionPayload, StartSessionResponse,
-    ChatPayload, ChatResponse, TextRecommendQuery, RecommendationResponse, Product
+    ChatPayload, ChatResponse, TextRecommendQuery, RecommendationResponse, Product,
+    BatchJobResponse, BatchRecommendationResult, BatchRecommendationResultsResponse
 )
+from batching import AsyncBatcher
+from session_store import SessionStore, InMemorySessionStore, RedisSessionStore, SessionLockTimeoutError
+from product_index import ProductVectorIndex, embed_texts
+from semantic_cache import SemanticCache
+from logging_setup import UVICORN_LOGGERS, queue_logger_handlers, start_queue_logging
 from utils import (
-    load_products_from_file, format_products_for_llm,
-    _get_recommendations_from_llm, _get_image_description_from_llm
+    load_products_from_file, build_products_index, format_product_lines_for_llm, format_products_for_llm,
+    build_generation_config, compile_prompt_template, format_user_profile,
+    create_catalog_cache, resolve_catalog_cache_name, fetch_recommended_products, read_upload_file,
+    validate_image_upload,
+    _get_recommendations_from_llm, _get_batched_recommendations_from_llm,
+    _get_image_description_from_llm, _get_batched_image_descriptions_from_llm, _get_image_recommendations_from_llm,
+    _submit_batch_recommendations_to_llm, _get_batch_recommendations_from_llm
 )
 
+logger = logging.getLogger(__name__)
+
+# Prompt templates are parsed once at import; rendering only joins the pre-split chunks
+render_persona_prompt = compile_prompt_template(settings.rufus_persona_template)
+render_text_recommendation_prompt = compile_prompt_template(settings.text_recommendation_prompt_template)
+render_batch_text_recommendation_prompt = compile_prompt_template(settings.batch_text_recommendation_prompt_template)
+render_image_recommendation_prompt = compile_prompt_template(settings.image_recommendation_prompt_template)
+
+
+@dataclass
+class AppContext:
+    """Shared resources created once at startup and handed to every request through `get_ctx`."""
+    gemini_client: genai.Client
+    # Bounds concurrent Gemini operations so bursts queue here instead of tripping rate limits
+    gemini_semaphore: asyncio.Semaphore
+    products_db: List[Dict]
+    products_by_id: Dict[str, Product]
+    product_context: str
+    product_context_lines: Dict[str, str]
+    catalog_cache_text: str
+    product_index: Optional[ProductVectorIndex]
+    catalog_caches: Dict
+    session_store: SessionStore
+    reco_cache: TTLCache
+    # Text queries currently being answered, keyed like reco_cache
+    reco_in_flight: Dict[Tuple[str, int], asyncio.Future]
+    semantic_cache: Optional[SemanticCache]
+    # Set right after the context is created, since the batchers call back into it
+    reco_batcher: AsyncBatcher = field(init=False)
+    image_batcher: AsyncBatcher = field(init=False)
+
+
+@lru_cache(maxsize=1024)
+def _initial_history(user_profile_str: str) -> Tuple[genai_types.Content, ...]:
+    """Returns the opening turns of a session: the persona prompt for a profile and Rufus's greeting.
+
+    Sessions start from these turns instead of asking Gemini for a greeting, and
+    since they are part of the history, the persona survives in every session store.
+    Repeat profiles reuse the same contents.
+    """
+    return (
+        genai_types.Content(
+            role="user",
+            parts=[genai_types.Part.from_text(text=render_persona_prompt(user_profile_details=user_profile_str))]
+        ),
+        genai_types.Content(role="model", parts=[genai_types.Part.from_text(text=settings.rufus_greeting)]),
+    )
+
+
+def _sse_event(event: str, data: Dict) -> str:
+    """Formats one Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+def _uses_text_retrieval(product_index: Optional[ProductVectorIndex]) -> bool:
+    """Whether text queries send only their nearest products instead of the whole catalog."""
+    return product_index is not None and product_index.index.ntotal > settings.text_retrieval_top_k
+
+
+def _query_embedding_task_type(ctx: AppContext) -> str:
+    """Embedding task type for text queries in the semantic cache.
+
+    With retrieval, queries are embedded as retrieval queries so the same vector
+    serves both the semantic cache lookup and the product search.
+    """
+    return "RETRIEVAL_QUERY" if _uses_text_retrieval(ctx.product_index) else "SEMANTIC_SIMILARITY"
+
+
+async def _text_product_context(
+        ctx: AppContext,
+        user_queries: List[str],
+        query_embeddings: List[Optional[np.ndarray]]
+) -> Tuple[str, Optional[str], Optional[List[List[str]]]]:
+    """Returns the product context for a batch of text queries, the catalog cache name, if
+    one is used, and each query's nearest product IDs, if retrieval was used.
+
+    Large catalogs are narrowed to the union of each query's nearest products in the
+    product index, reusing the queries' embeddings when all of them are already known;
+    otherwise the full (possibly cached) catalog is used.
+    """
+    gemini_client = ctx.gemini_client
+    if _uses_text_retrieval(ctx.product_index):
+        try:
+            nearest_ids = await ctx.product_index.search_many(
+                gemini_client,
+                user_queries,
+                settings.text_retrieval_top_k,
+                query_embeddings=np.stack(query_embeddings) if all(e is not None for e in query_embeddings) else None
+            )
+            candidate_ids = list(dict.fromkeys(product_id for ids in nearest_ids for product_id in ids))
+            logger.info("Retrieved %s candidate products for %s text queries.", len(candidate_ids), len(user_queries))
+            return "\n".join(ctx.product_context_lines[product_id] for product_id in candidate_ids), None, nearest_ids
+        except Exception as e:
+            logger.warning("Product retrieval failed, sending the full catalog instead: %s", e)
+
+    cache_name = await resolve_catalog_cache_name(
+        gemini_client,
+        ctx.catalog_caches,
+        settings.text_recommendation_model_name,
+        ctx.catalog_cache_text,
+        settings.catalog_cache_ttl_seconds,
+        settings.catalog_cache_refresh_margin_seconds
+    )
+    return settings.cached_product_context_reference if cache_name else ctx.product_context, cache_name, None
+
+
+async def _recommend_text_query(
+        ctx: AppContext,
+        user_query: str,
+        product_context: str,
+        cache_name: Optional[str]
+) -> Tuple[List[Product], str]:
+    """Runs a Gemini recommendation call for one text query against the given product context."""
+    prompt = render_text_recommendation_prompt(
+        user_query=user_query,
+        product_context=product_context
+    )
+    logger.debug("Text recommendation prompt (first 100 chars): %s...", prompt[:100])
+    return await _get_recommendations_from_llm(
+        prompt,
+        settings.text_recommendation_model_name,
+        ctx.gemini_client,
+        ctx.products_by_id,
+        cached_content=cache_name,
+        service_tier=settings.recommendation_service_tier
+    )
+
+
+async def _recommend_text_batch(
+        ctx: AppContext,
+        queries: List[Tuple[str, Optional[np.ndarray]]]
+) -> List[Union[Tuple[Tuple[List[Product], str], bool], BaseException]]:
+    """Runs a single Gemini recommendation call for the `(text query, query embedding or None)`
+    pairs collected by the batcher.
+
+    Returns one `(recommendation, cacheable)` pair per query. Answers taken from a
+    prompt shared by several users' queries are not cacheable, since one query's
+    text could sway the answers to the others. With retrieval, each query's
+    answer is also limited to its own nearest products. Queries the batched
+    response leaves out are asked again on their own, one after another under
+    the same concurrency slot, rather than being answered as having no match.
+    """
+    user_queries = [user_query for user_query, _ in queries]
+    async with ctx.gemini_semaphore:
+        product_context, cache_name, nearest_ids = await _text_product_context(
+            ctx, user_queries, [query_embedding for _, query_embedding in queries]
+        )
+
+        if len(user_queries) == 1:
+            return [(await _recommend_text_query(ctx, user_queries[0], product_context, cache_name), True)]
+
+        prompt = render_batch_text_recommendation_prompt(
+            user_queries="\n".join(f"{i}) {orjson.dumps(q).decode()}" for i, q in enumerate(user_queries, start=1)),
+            product_context=product_context
+        )
+        logger.debug(
+            "Batched text recommendation prompt for %s queries (first 100 chars): %s...",
+            len(user_queries), prompt[:100]
+        )
+        batched_results = await _get_batched_recommendations_from_llm(
+            prompt,
+            len(user_queries),
+            settings.text_recommendation_model_name,
+            ctx.gemini_client,
+            ctx.products_by_id,
+            cached_content=cache_name,
+            service_tier=settings.recommendation_service_tier,
+            allowed_ids_by_query=[set(ids) for ids in nearest_ids] if nearest_ids is not None else None
+        )
+
+        results = []
+        for user_query, recommendation in zip(user_queries, batched_results):
+            if recommendation is not None:
+                results.append((recommendation, False))
+                continue
+            try:
+                results.append((await _recommend_text_query(ctx, user_query, product_context, cache_name), True))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+async def _describe_image(ctx: AppContext, image_bytes: bytes, mime_type: str) -> Optional[str]:
+    """Describes a single uploaded image with its own Gemini vision call."""
+    async with ctx.gemini_semaphore:
+        return await _get_image_description_from_llm(
+            image_bytes,
+            mime_type,
+            ctx.gemini_client,
+            settings.image_to_text_prompt,
+            settings.image_description_model_name,
+            service_tier=settings.recommendation_service_tier
+        )
+
+
+async def _describe_image_batch(
+        ctx: AppContext,
+        images: List[Tuple[bytes, str]]
+) -> List[Union[Optional[str], BaseException]]:
+    """Runs a single Gemini vision call for the `(image bytes, MIME type)` uploads collected by the batcher.
+
+    If the batched call fails, each image is retried on its own, so one bad upload
+    only fails its own request.
+    """
+    if len(images) == 1:
+        return [await _describe_image(ctx, *images[0])]
+    try:
+        async with ctx.gemini_semaphore:
+            return await _get_batched_image_descriptions_from_llm(
+                images,
+                ctx.gemini_client,
+                settings.batch_image_to_text_prompt,
+                settings.image_description_model_name,
+                service_tier=settings.recommendation_service_tier
+            )
+    except Exception as e:
+        logger.warning("Batched description of %s images failed, describing them one by one: %s", len(images), e)
+        return await asyncio.gather(*(_describe_image(ctx, *image) for image in images), return_exceptions=True)
+
+
+def _finish_in_flight_recommendation(ctx: AppContext, cache_key: Tuple[str, int], future: asyncio.Future) -> None:
+    """Forgets a finished in-flight query and retrieves its exception, which may have no waiters left."""
+    ctx.reco_in_flight.pop(cache_key, None)
+    if not future.cancelled() and future.exception() is not None:
+        logger.debug("In-flight text recommendation for %s failed: %s", cache_key, future.exception())
+
+
+async def _resolve_text_recommendation(
+        ctx: AppContext,
+        cache_key: Tuple[str, int],
+        user_query: str
+) -> Tuple[List[Product], str]:
+    """Answers a text query missing from the exact cache, via the semantic cache or the batcher, and caches it."""
+    query_embedding = None
+    if ctx.semantic_cache is not None:
+        try:
+            async with ctx.gemini_semaphore:
+                query_embedding = (await embed_texts(
+                    ctx.gemini_client,
+                    [cache_key[0]],
+                    settings.embedding_model_name,
+                    _query_embedding_task_type(ctx),
+                    settings.embedding_dimensionality
+                ))[0]
+            cached_recommendation = ctx.semantic_cache.get(query_embedding)
+            if cached_recommendation is not None:
+                logger.debug("Semantic text recommendation cache hit for query: '%s'", user_query)
+                ctx.reco_cache[cache_key] = cached_recommendation
+                return cached_recommendation
+        except Exception as e:
+            logger.warning("Semantic cache lookup failed for query '%s': %s", user_query, e)
+
+    # The embedding is reused for product retrieval, so a miss costs one embedding call
+    recommendation, cacheable = await ctx.reco_batcher.process((user_query, query_embedding))
+    if cacheable:
+        ctx.reco_cache[cache_key] = recommendation
+        if query_embedding is not None:
+            ctx.semantic_cache.set(query_embedding, recommendation)
+    return recommendation
+
+
 # --- Application Lifecycle (Lifespan Events) ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    print("INFO: Application startup sequence initiated...")
+    # Resources registered on the stack are released in reverse order at shutdown,
+    # and also when startup fails part-way through
+    async with AsyncExitStack() as resources:
+        resources.callback(start_queue_logging(settings.log_level).stop)
+        for logger_name in UVICORN_LOGGERS:
+            resources.callback(queue_logger_handlers(logger_name))
+        logger.info("Application startup sequence initiated...")
+
+        executor_max_workers = settings.default_executor_max_workers or min(32, (os.cpu_count() or 1) * 2)
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=executor_max_workers))
+        logger.info("Default thread pool executor sized to %s workers.", executor_max_workers)
+
+        logger.info("Initializing Gemini client...")
+        try:
+            # One long-lived aiohttp session so async Gemini calls reuse pooled TLS connections
+            gemini_http_session = await resources.enter_async_context(aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=settings.gemini_max_connections,
+                    limit_per_host=settings.gemini_max_connections,
+                    keepalive_timeout=settings.gemini_keepalive_timeout_seconds
+                ),
+                trust_env=True
+            ))
+            gemini_client = genai.Client(
+                api_key=settings.gemini_api_key,
+                http_options=genai_types.HttpOptions(
+                    timeout=settings.gemini_request_timeout_ms,
+                    aiohttp_client=gemini_http_session,
+                    # Retries 408, 429 and 5xx responses with exponential backoff and jitter
+                    retry_options=genai_types.HttpRetryOptions(
+                        attempts=settings.gemini_retry_attempts,
+                        initial_delay=settings.gemini_retry_initial_delay_seconds,
+                        max_delay=settings.gemini_retry_max_delay_seconds
+                    )
+                )
+            )
+            resources.callback(gemini_client.close)
+            resources.push_async_callback(gemini_client.aio.aclose)
+            logger.info("Successfully initialized Gemini client.")
+        except Exception as e:
+            logger.critical("Failed to initialize Gemini client: %s", e)
+            raise RuntimeError(f"Failed to initialize Gemini client: {e}") from e
+
+        logger.info("Loading product database...")
+        products_db = load_products_from_file(settings.products_json_path)
+        logger.info("Loaded %s products into app state.", len(products_db))
+        products_by_id = build_products_index(products_db)
+        logger.info("Indexed %s products by ID.", len(products_by_id))
+        # Each product is formatted once; retrieval reuses the per-product lines
+        product_context_lines = format_product_lines_for_llm(products_db, settings.product_description_max_chars)
+        product_context = format_products_for_llm(product_context_lines.values())
+        catalog_cache_text = settings.catalog_cache_prompt_template.format(product_context=product_context)
+        logger.info("Precomputed product context for LLM prompts (%s chars).", len(product_context))
+
+        product_index = None
+        if settings.product_index_enabled and products_db:
+            logger.info("Building product embedding index with %s...", settings.embedding_model_name)
+            try:
+                product_index = await ProductVectorIndex.build(
+                    gemini_client,
+                    products_db,
+                    settings.embedding_model_name,
+                    settings.embedding_dimensionality,
+                    embeddings_path=settings.product_embeddings_path,
+                    index_type=settings.product_index_type,
+                    nlist=settings.product_index_nlist,
+                    pq_m=settings.product_index_pq_m,
+                    pq_nbits=settings.product_index_pq_nbits,
+                    nprobe=settings.product_index_nprobe,
+                    hnsw_m=settings.product_index_hnsw_m,
+                    ef_construction=settings.product_index_ef_construction,
+                    ef_search=settings.product_index_ef_search
+                )
+                logger.info("Indexed %s product embeddings for image matching.", product_index.index.ntotal)
+            except Exception as e:
+                logger.warning("Could not build product embedding index, image matching will use the LLM: %s", e)
+
+        catalog_caches = {}
+        if settings.catalog_cache_enabled and products_db:
+            logger.info("Creating Gemini context caches for the product catalog...")
+            catalog_model_names = set()
+            if not _uses_text_retrieval(product_index):
+                catalog_model_names.add(settings.text_recommendation_model_name)
+            if product_index is None:
+                catalog_model_names.add(settings.image_description_model_name)
+            for model_name in catalog_model_names:
+                catalog_caches[model_name] = await create_catalog_cache(
+                    gemini_client, model_name, catalog_cache_text, settings.catalog_cache_ttl_seconds
+                )
+
+        if settings.redis_url:
+            session_store = RedisSessionStore.from_url(
+                settings.redis_url,
+                settings.session_ttl_seconds,
+                max_connections=settings.redis_max_connections,
+                lock_timeout_seconds=settings.session_lock_timeout_seconds,
+                lock_wait_seconds=settings.session_lock_wait_seconds
+            )
+            logger.info("Redis session store initialized; chat histories will be shared across workers.")
+        else:
+            # Bounded in-memory store; idle sessions expire after session_ttl_seconds
+            session_store = InMemorySessionStore(
+                settings.session_max_count,
+                settings.session_ttl_seconds,
+                lock_wait_seconds=settings.session_lock_wait_seconds
+            )
+            logger.info("In-memory session chat store initialized.")
+        resources.push_async_callback(session_store.close)
+
+        reco_cache = TTLCache(maxsize=settings.reco_cache_max_size, ttl=settings.reco_cache_ttl_seconds)
+        logger.info("Text recommendation cache initialized.")
+
+        semantic_cache = None
+        if settings.semantic_cache_enabled:
+            semantic_cache = SemanticCache(
+                settings.semantic_cache_max_size,
+                settings.embedding_dimensionality,
+                settings.semantic_cache_similarity_threshold,
+                settings.reco_cache_ttl_seconds
+            )
+            logger.info("Semantic text recommendation cache initialized.")
+
+        # Everything requests need is checked and gathered here once, instead of on every request
+        ctx = app.state.ctx = AppContext(
+            gemini_client=gemini_client,
+            gemini_semaphore=asyncio.Semaphore(settings.gemini_max_concurrency),
+            products_db=products_db,
+            products_by_id=products_by_id,
+            product_context=product_context,
+            product_context_lines=product_context_lines,
+            catalog_cache_text=catalog_cache_text,
+            product_index=product_index,
+            catalog_caches=catalog_caches,
+            session_store=session_store,
+            reco_cache=reco_cache,
+            reco_in_flight={},
+            semantic_cache=semantic_cache
+        )
 
-    print("INFO: Initializing Gemini client...")
-    try:
-        app.state.gemini_client = genai.Client(api_key=settings.gemini_api_key)
-        print("INFO: Successfully initialized Gemini client.")
-    except Exception as e:
-        print(f"CRITICAL: Failed to initialize Gemini client: {e}")
-        raise RuntimeError(f"Failed to initialize Gemini client: {e}") from e
-
-    print("INFO: Loading product database...")
-    app.state.products_db = load_products_from_file(settings.products_json_path)
-    print(f"INFO: Loaded {len(app.state.products_db)} products into app state.")
-
-    app.state.session_chats = {} # Initialize in-memory session chat store
-    print("INFO: In-memory session chat store initialized.")
-
-    print("INFO: Configuring static file serving for product images...")
-    if settings.products_image_path.exists() and settings.products_image_path.is_dir():
-        app.mount("/api/products/images", StaticFiles(directory=settings.products_image_path), name="product_images")
-        print(f"INFO: Serving static files from {settings.products_image_path} at /api/products/images")
-    else:
-        print(f"WARNING: Product images directory not found at {settings.products_image_path}. Images will not be served.")
-
-    print("INFO: Application startup complete.")
-    yield
-    # Shutdown
-    print("INFO: Application shutdown sequence initiated...")
-    if hasattr(app.state, 'products_db'):
-        app.state.products_db.clear()
-        print("INFO: Product database cleared from app state.")
-    if hasattr(app.state, 'session_chats'):
-        app.state.session_chats.clear()
-        print("INFO: Session chat store cleared from app state.")
-    print("INFO: Application shutdown complete.")
+        ctx.reco_batcher = AsyncBatcher(
+            partial(_recommend_text_batch, ctx),
+            max_batch_size=settings.reco_batch_max_size,
+            max_queue_time=settings.reco_batch_max_wait_ms / 1000
+        )
+        ctx.reco_batcher.start()
+        resources.push_async_callback(ctx.reco_batcher.stop)
+        logger.info("Text recommendation micro-batcher started.")
+        ctx.image_batcher = AsyncBatcher(
+            partial(_describe_image_batch, ctx),
+            max_batch_size=settings.image_batch_max_size,
+            max_queue_time=settings.image_batch_max_wait_ms / 1000,
+            item_weight=lambda image: len(image[0]),
+            max_batch_weight=settings.image_batch_max_bytes
+        )
+        ctx.image_batcher.start()
+        resources.push_async_callback(ctx.image_batcher.stop)
+        logger.info("Image description micro-batcher started.")
+
+        logger.info("Configuring static file serving for product images...")
+        if settings.products_image_path.exists() and settings.products_image_path.is_dir():
+            app.mount("/api/products/images", StaticFiles(directory=settings.products_image_path), name="product_images")
+            logger.info("Serving static files from %s at /api/products/images", settings.products_image_path)
+        else:
+            logger.warning(
+                "Product images directory not found at %s. Images will not be served.",
+                settings.products_image_path
+            )
+
+        logger.info("Application startup complete.")
+        yield
+        # Shutdown
+        logger.info("Application shutdown sequence initiated...")
+        ctx.products_db.clear()
+        ctx.products_by_id.clear()
+        ctx.product_context_lines.clear()
+        ctx.product_index = None
+        logger.info("Product data released from app state.")
+        ctx.reco_cache.clear()
+        if ctx.semantic_cache is not None:
+            ctx.semantic_cache.clear()
+        logger.info("Text recommendation caches cleared from app state.")
+        for cached_content in ctx.catalog_caches.values():
+            if cached_content is None:
+                continue
+            try:
+                await ctx.gemini_client.aio.caches.delete(name=cached_content.name)
+                logger.info("Deleted catalog context cache %s.", cached_content.name)
+            except Exception as e:
+                logger.warning("Failed to delete catalog context cache %s: %s", cached_content.name, e)
+        del app.state.ctx
+        logger.info("Application shutdown complete; releasing batchers, session store and Gemini connections.")
 
 
 app = FastAPI(
     title="E-Commerce AI Agent API",
     description="API for Rufus, the AI-powered e-commerce assistant.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
@@ -69,28 +512,13 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.allowed_origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=settings.allowed_methods,
+    allow_headers=settings.allowed_headers,
 )
 
 # --- Dependencies Injection---
-def get_gemini_client(request: Request) -> genai.Client:
-    if not hasattr(request.app.state, 'gemini_client') or request.app.state.gemini_client is None:
-        print("ERROR: Gemini client not available in app.state.")
-        raise HTTPException(status_code=503, detail="Gemini service is temporarily unavailable.")
-    return request.app.state.gemini_client
-
-def get_products_db(request: Request) -> List[Dict]:
-    if not hasattr(request.app.state, 'products_db'):
-        print("ERROR: Products DB not available in app.state.")
-        raise HTTPException(status_code=503, detail="Product information is temporarily unavailable.")
-    return request.app.state.products_db
-
-def get_session_chats(request: Request) -> Dict:
-    if not hasattr(request.app.state, 'session_chats'):
-        print("ERROR: Session chats not available in app.state.")
-        raise HTTPException(status_code=503, detail="Session manager is temporarily unavailable.")
-    return request.app.state.session_chats
+def get_ctx(request: Request) -> AppContext:
+    return request.app.state.ctx
 
 
 # --- API Endpoints ---
@@ -102,146 +530,353 @@ async def read_root():
 @app.post("/api/agent/start_session", response_model=StartSessionResponse)
 async def start_session(
         payload: StartSessionPayload,
-        gemini_client: genai.Client = Depends(get_gemini_client),
-        session_chats: Dict = Depends(get_session_chats)
+        ctx: AppContext = Depends(get_ctx)
 ):
     """
     Starts a new chat session with Rufus.
     Returns a session ID and Rufus's initial greeting.
     """
-    print("--- Attempting to start session ---")
+    logger.debug("Attempting to start session")
     session_id = str(uuid.uuid4())
     user_profile = payload.user_info if payload.user_info is not None else settings.default_user_profile
-    user_profile_str = ", ".join(f"{k}: {v}" for k, v in user_profile.items())
-
-    initial_system_prompt_content = settings.rufus_persona_template.format(
-        user_profile_details=user_profile_str
-    )
-    print(f"DEBUG: Starting session {session_id} for user profile: {user_profile_str}")
+    user_profile_str = format_user_profile(user_profile)
+    logger.debug("Starting session %s for user profile: %s", session_id, user_profile_str)
 
     try:
-        chat = gemini_client.aio.chats.create(model=settings.chat_model_name)
-        response = await chat.send_message(initial_system_prompt_content)
-        rufus_greeting = response.text
-
-        session_chats[session_id] = chat
-        print(f"INFO: Session {session_id} started. Rufus greeting: '{rufus_greeting[:50]}...'")
-        return StartSessionResponse(session_id=session_id, initial_message=rufus_greeting)
+        chat = _create_chat(ctx, list(_initial_history(user_profile_str)))
+        await ctx.session_store.save_chat(session_id, chat)
+        logger.info("Session %s started.", session_id)
+        return StartSessionResponse(session_id=session_id, initial_message=settings.rufus_greeting)
     except Exception as e:
-        print(f"ERROR: Error during chat session start with Gemini API ({settings.chat_model_name}): {e}")
+        logger.error("Error during chat session start for session %s: %s", session_id, e)
         raise HTTPException(status_code=500, detail=f"Error starting chat session. Please contact support.")
 
 
+@asynccontextmanager
+async def _session_lock(ctx: AppContext, session_id: str):
+    """Serializes turns on a session, answering 409 if a previous turn holds it for too long."""
+    try:
+        async with ctx.session_store.lock(session_id):
+            yield
+    except SessionLockTimeoutError as e:
+        logger.warning("%s", e)
+        raise HTTPException(status_code=409, detail="Another message for this session is still being processed.")
+
+
+def _create_chat(ctx: AppContext, history: Optional[List[genai_types.Content]] = None) -> AsyncChat:
+    """Creates a chat with the configured chat model, optionally continuing an earlier history."""
+    return ctx.gemini_client.aio.chats.create(
+        model=settings.chat_model_name,
+        config=build_generation_config(service_tier=settings.chat_service_tier),
+        history=history
+    )
+
+
+async def _load_chat_session(ctx: AppContext, session_id: str) -> AsyncChat:
+    """Returns the chat for a session, or answers 404 if the session does not exist or has expired."""
+    chat_session = await ctx.session_store.load_chat(session_id, partial(_create_chat, ctx))
+    if chat_session is None:
+        logger.warning("Chat session not found: %s", session_id)
+        raise HTTPException(status_code=404, detail="Session not found. Please start a new session.")
+    return chat_session
+
+
 @app.post("/api/agent/chat", response_model=ChatResponse)
 async def chat_with_agent(
         payload: ChatPayload,
-        session_chats: Dict = Depends(get_session_chats)
+        ctx: AppContext = Depends(get_ctx)
 ):
     """Handles an ongoing chat message within an existing session."""
-    chat_session = session_chats.get(payload.session_id)
-    if not chat_session:
-        print(f"WARNING: Chat session not found: {payload.session_id}")
-        raise HTTPException(status_code=404, detail="Session not found. Please start a new session.")
+    async with _session_lock(ctx, payload.session_id):
+        chat_session = await _load_chat_session(ctx, payload.session_id)
+
+        logger.debug("Received message for session %s: '%s...'", payload.session_id, payload.message[:50])
+        try:
+            async with ctx.gemini_semaphore:
+                response = await chat_session.send_message(payload.message)
+            await ctx.session_store.save_chat(payload.session_id, chat_session)
+            logger.info("Response sent for session %s.", payload.session_id)
+            return ChatResponse(message=response.text)
+        except Exception as e:
+            logger.error("Error during chat with Gemini API for session %s: %s", payload.session_id, e)
+            raise HTTPException(status_code=500, detail=f"Error processing chat message. Please try again.")
+
+
+async def _read_chat_reply_stream(
+        ctx: AppContext,
+        chat_session: AsyncChat,
+        message: str,
+        chunks: asyncio.Queue
+) -> None:
+    """Reads a streamed Gemini reply into `chunks` under the concurrency limit, then queues `None`.
+
+    Runs apart from the response, so a slow client never holds a `gemini_semaphore` slot.
+    """
+    try:
+        async with ctx.gemini_semaphore:
+            async for chunk in await chat_session.send_message_stream(message):
+                if chunk.text:
+                    chunks.put_nowait(chunk.text)
+    finally:
+        chunks.put_nowait(None)
+
 
-    print(f"DEBUG: Received message for session {payload.session_id}: '{payload.message[:50]}...'")
+@app.post("/api/agent/chat/stream")
+async def chat_with_agent_stream(
+        payload: ChatPayload,
+        background_tasks: BackgroundTasks,
+        ctx: AppContext = Depends(get_ctx)
+):
+    """
+    Handles an ongoing chat message and streams Rufus's reply as Server-Sent Events.
+    Each `message` event carries a `{"text": ...}` chunk; a final `done` or `error` event ends the stream.
+    """
+    # The session lock is taken here so a busy or missing session still gets its 409/404,
+    # and held until the stream finishes. The generator releases it, and the background
+    # task releases it too in case the client disconnects before the stream ever starts.
+    session_lock = AsyncExitStack()
+    await session_lock.enter_async_context(_session_lock(ctx, payload.session_id))
     try:
-        response = await chat_session.send_message(payload.message)
-        print(f"INFO: Response sent for session {payload.session_id}. Response: '{response.text[:50]}...'")
-        return ChatResponse(message=response.text)
-    except Exception as e:
-        print(f"ERROR: Error during chat with Gemini API for session {payload.session_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing chat message. Please try again.")
+        chat_session = await _load_chat_session(ctx, payload.session_id)
+    except BaseException:
+        await session_lock.aclose()
+        raise
+    background_tasks.add_task(session_lock.aclose)
+    logger.debug("Received streaming message for session %s: '%s...'", payload.session_id, payload.message[:50])
+
+    async def event_stream():
+        async with session_lock:
+            chunks = asyncio.Queue()
+            reader = asyncio.create_task(_read_chat_reply_stream(ctx, chat_session, payload.message, chunks))
+            try:
+                while (text := await chunks.get()) is not None:
+                    yield _sse_event("message", {"text": text})
+                await reader
+                await ctx.session_store.save_chat(payload.session_id, chat_session)
+                logger.info("Streamed response sent for session %s.", payload.session_id)
+                yield _sse_event("done", {})
+            except Exception as e:
+                logger.error("Error during streaming chat with Gemini API for session %s: %s", payload.session_id, e)
+                yield _sse_event("error", {"detail": "Error processing chat message. Please try again."})
+            finally:
+                reader.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", background=background_tasks)
 
 
 @app.post("/api/agent/recommend-text", response_model=RecommendationResponse)
 async def recommend_text_products(
         payload: TextRecommendQuery,
-        gemini_client: genai.Client = Depends(get_gemini_client),
-        products_db: List[Dict] = Depends(get_products_db)
+        ctx: AppContext = Depends(get_ctx)
 ):
     user_query = payload.query
-    print(f"INFO: Received text recommendation query: '{user_query}'")
+    logger.debug("Received text recommendation query: '%s'", user_query)
 
-    if not products_db:
-        print("WARNING: Product database is empty. Cannot provide image-based recommendations.")
+    if not ctx.products_db:
+        logger.warning("Product database is empty. Cannot provide image-based recommendations.")
         return RecommendationResponse(
             recommendations=[],
             message="Rufus: I'm sorry, but our product catalog seems to be empty at the moment."
         )
 
-    product_context = format_products_for_llm(products_db)
-    prompt = settings.text_recommendation_prompt_template.format(
-        user_query=user_query,
-        product_context=product_context
-    )
-    print(f"DEBUG: Text recommendation prompt (first 100 chars): {prompt[:100]}...")
+    # Concurrent misses for the same key are deduplicated through reco_in_flight: the first
+    # request starts the work and caches the result, and later ones await the same future.
+    cache_key = (user_query.strip().lower(), len(ctx.products_db))
+    cached_recommendation = ctx.reco_cache.get(cache_key)
 
     try:
-        recommended_products_details, message_segment = await _get_recommendations_from_llm(
-            prompt,
-            settings.text_recommendation_model_name,
-            gemini_client,
-            products_db
-        )
+        if cached_recommendation is not None:
+            logger.debug("Text recommendation cache hit for query: '%s'", user_query)
+            recommended_products_details, message_segment = cached_recommendation
+        else:
+            # Identical queries arriving while one is being answered share its result
+            pending = ctx.reco_in_flight.get(cache_key)
+            if pending is None:
+                pending = ctx.reco_in_flight[cache_key] = asyncio.ensure_future(
+                    _resolve_text_recommendation(ctx, cache_key, user_query)
+                )
+                pending.add_done_callback(partial(_finish_in_flight_recommendation, ctx, cache_key))
+            else:
+                logger.debug("Joining in-flight text recommendation for query: '%s'", user_query)
+            # Shielded so a disconnecting client does not cancel the work other requests wait on
+            recommended_products_details, message_segment = await asyncio.shield(pending)
         rufus_message = f"Rufus: Okay, for your query '{user_query}', I've looked through our products." + message_segment
-        print(f"INFO: Final Rufus message for text recommendation: {rufus_message}")
+        logger.info("Final Rufus message for text recommendation: %s", rufus_message)
         return RecommendationResponse(recommendations=recommended_products_details, message=rufus_message)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error processing text recommendation. Please check server logs.")
 
 
+@app.post("/api/agent/recommend-text/batch", response_model=BatchJobResponse)
+async def submit_batch_text_recommendations(
+        payload: List[TextRecommendQuery],
+        ctx: AppContext = Depends(get_ctx)
+):
+    """
+    Submits text recommendation queries as a Gemini Batch Mode job for offline workloads.
+    Results are keyed `req_<index>` in the order the queries were given.
+    """
+    logger.info("Received batch text recommendation request with %s queries.", len(payload))
+    if not payload:
+        raise HTTPException(status_code=400, detail="At least one query is required.")
+    if len(payload) > settings.max_batch_recommendation_queries:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch may contain at most {settings.max_batch_recommendation_queries} queries."
+        )
+    if not ctx.products_db:
+        logger.warning("Product database is empty. Cannot submit batch recommendations.")
+        raise HTTPException(status_code=503, detail="Our product catalog seems to be empty at the moment.")
+
+    prompts = [
+        render_text_recommendation_prompt(user_query=q.query, product_context=ctx.product_context)
+        for q in payload
+    ]
+    try:
+        async with ctx.gemini_semaphore:
+            batch_job = await _submit_batch_recommendations_to_llm(
+                prompts,
+                settings.text_recommendation_model_name,
+                ctx.gemini_client
+            )
+        return BatchJobResponse(job_name=batch_job.name, state=batch_job.state.value)
+    except Exception as e:
+        logger.error("Error submitting batch job with %s queries: %s", len(payload), e)
+        raise HTTPException(status_code=500, detail="Error submitting batch recommendation job. Please check server logs.")
+
+
+@app.get("/api/agent/recommend-text/batch/{job_name:path}/results", response_model=BatchRecommendationResultsResponse)
+async def get_batch_text_recommendations(
+        job_name: str,
+        ctx: AppContext = Depends(get_ctx)
+):
+    """Returns the state of a batch recommendation job and its results once it has succeeded."""
+    try:
+        async with ctx.gemini_semaphore:
+            batch_job, results = await _get_batch_recommendations_from_llm(
+                job_name, ctx.gemini_client, ctx.products_by_id
+            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error fetching batch job %s: %s", job_name, e)
+        raise HTTPException(status_code=500, detail="Error fetching batch recommendation job. Please check server logs.")
+
+    return BatchRecommendationResultsResponse(
+        job_name=batch_job.name,
+        state=batch_job.state.value,
+        results=[
+            BatchRecommendationResult(
+                key=key,
+                recommendations=recommended_products_details,
+                message="Rufus: I've looked through our products." + message_segment
+            )
+            for key, recommended_products_details, message_segment in results
+        ]
+    )
+
+
 @app.post("/api/agent/recommend-image", response_model=RecommendationResponse)
 async def recommend_image_products(
         file: UploadFile = File(...),
-        gemini_client: genai.Client = Depends(get_gemini_client),
-        products_db: List[Dict] = Depends(get_products_db)
+        ctx: AppContext = Depends(get_ctx)
 ):
-    print(f"INFO: Received image recommendation request for file: {file.filename} (type: {file.content_type})")
+    logger.info("Received image recommendation request for file: %s (type: %s)", file.filename, file.content_type)
 
-    if not products_db:
-        print("WARNING: Product database is empty. Cannot provide image-based recommendations.")
+    if not ctx.products_db:
+        logger.warning("Product database is empty. Cannot provide image-based recommendations.")
         return RecommendationResponse(
             recommendations=[],
             message="Rufus: I'm sorry, but our product catalog seems to be empty at the moment."
         )
 
     try:
-        image_description = await _get_image_description_from_llm(
-            file,
-            gemini_client,
-            settings.image_to_text_prompt,
-            settings.image_description_model_name
+        # Reject oversized or non-image uploads before spending a vision model call on them
+        image_mime_type = await validate_image_upload(
+            file, settings.max_image_bytes, settings.allowed_image_mime_types
         )
-
-        if image_description is None:
-            if hasattr(file, 'filename') and file.filename and not await file.seek(0) and not await file.read():
-                print(f"WARNING: Uploaded file {file.filename} is empty.")
-                raise HTTPException(status_code=400, detail="Uploaded file is empty.")
-
+        if ctx.product_index is not None:
+            # Describe the image, then match the description against the local embedding index
+            image_bytes = await read_upload_file(file, settings.max_image_bytes)
+            image_recommendation = None
+            image_description = await ctx.image_batcher.process((image_bytes, image_mime_type))
+            if image_description is not None:
+                async with ctx.gemini_semaphore:
+                    recommended_ids = await ctx.product_index.search(
+                        ctx.gemini_client, image_description, settings.image_match_top_k, settings.image_match_min_score
+                    )
+                logger.info("Product index matches for image description: %s", recommended_ids)
+                # No product clears the score threshold: answer like the LLM path does for an unknown product
+                if recommended_ids:
+                    image_recommendation = (image_description, *fetch_recommended_products(
+                        recommended_ids, ctx.products_by_id, settings.image_match_top_k
+                    ))
+        else:
+            # Reading the upload and refreshing the catalog cache are independent, so overlap them
+            image_bytes, cache_name = await asyncio.gather(
+                read_upload_file(file, settings.max_image_bytes),
+                resolve_catalog_cache_name(
+                    ctx.gemini_client,
+                    ctx.catalog_caches,
+                    settings.image_description_model_name,
+                    ctx.catalog_cache_text,
+                    settings.catalog_cache_ttl_seconds,
+                    settings.catalog_cache_refresh_margin_seconds
+                )
+            )
+            image_reco_prompt = render_image_recommendation_prompt(
+                product_context=settings.cached_product_context_reference if cache_name else ctx.product_context
+            )
+            logger.debug("Image recommendation prompt (first 100 chars): %s...", image_reco_prompt[:100])
+
+            async with ctx.gemini_semaphore:
+                image_recommendation = await _get_image_recommendations_from_llm(
+                    image_bytes,
+                    image_mime_type,
+                    ctx.gemini_client,
+                    image_reco_prompt,
+                    settings.image_description_model_name,
+                    ctx.products_by_id,
+                    cached_content=cache_name,
+                    service_tier=settings.recommendation_service_tier
+                )
+
+        if image_recommendation is None:
             message = "Rufus: I'm sorry, I couldn't clearly identify a product in the image you sent."
-            print(f"INFO: {message}")
+            logger.info("%s", message)
             return RecommendationResponse(recommendations=[], message=message)
 
-        product_context = format_products_for_llm(products_db)
-        text_reco_prompt_from_image = settings.text_reco_from_image_prompt_template.format(
-            image_description=image_description,
-            product_context=product_context
-        )
-        print(f"DEBUG: Text recommendation from image prompt (first 100 chars): {text_reco_prompt_from_image[:100]}...")
-
-        recommended_products_details, message_segment = await _get_recommendations_from_llm(
-            text_reco_prompt_from_image,
-            settings.text_recommendation_model_name,
-            gemini_client,
-            products_db
-        )
+        image_description, recommended_products_details, message_segment = image_recommendation
 
         rufus_message = f"Rufus: Based on the image (which I see as about '{image_description}')," + message_segment
-        print(f"INFO: Final Rufus message for image recommendation: {rufus_message}")
+        logger.info("Final Rufus message for image recommendation: %s", rufus_message)
         return RecommendationResponse(recommendations=recommended_products_details, message=rufus_message)
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"ERROR: Unexpected error during image recommendation processing: {e}")
+        logger.error("Unexpected error during image recommendation processing: %s", e)
         raise HTTPException(status_code=500, detail="Rufus: Sorry, I encountered an error processing the image recommendation.")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    workers = settings.web_concurrency
+    if workers > 1 and not settings.redis_url:
+        logger.warning(
+            "WEB_CONCURRENCY=%s needs REDIS_URL so workers share chat sessions; starting a single worker.", workers
+        )
+        workers = 1
+
+    # "auto" picks uvloop and httptools when they are installed (uvloop is unavailable on Windows)
+    uvicorn.run(
+        "main:app",
+        host=settings.server_host,
+        port=settings.server_port,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        backlog=settings.server_backlog,
+        timeout_keep_alive=settings.server_keepalive_timeout_seconds
+    )
@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+from google import genai
+from google.genai import types as genai_types
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of texts sent in a single embed_content request
+EMBEDDING_REQUEST_BATCH_SIZE = 100
+# FAISS recommends roughly this many training vectors per IVF list / PQ centroid
+MIN_TRAINING_POINTS_PER_CENTROID = 39
+
+
+def product_embedding_text(product: Dict) -> str:
+    """Returns the text that represents a product in the embedding space."""
+    return f"{product.get('name', '')} {product.get('description', '')} {' '.join(product.get('tags', []))}".strip()
+
+
+def product_text_hash(product: Dict) -> str:
+    """Returns a digest of a product's embedding text, used to detect stale stored embeddings."""
+    return hashlib.sha1(product_embedding_text(product).encode("utf-8")).hexdigest()
+
+
+def normalize_embeddings(vectors) -> np.ndarray:
+    """Returns the vectors as a float32 array with L2-normalized rows, so inner product equals cosine similarity."""
+    embeddings = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def save_product_embeddings(
+        file_path: Path,
+        products: List[Dict],
+        embeddings: np.ndarray,
+        model_name: str,
+        dimensionality: int
+) -> None:
+    """Stores precomputed product embeddings so the index can be built without re-embedding the catalog."""
+    np.savez(
+        file_path,
+        product_ids=np.array([p["id"] for p in products]),
+        text_hashes=np.array([product_text_hash(p) for p in products]),
+        embeddings=embeddings,
+        model_name=np.array(model_name),
+        dimensionality=np.array(dimensionality)
+    )
+
+
+def load_product_embeddings(file_path: Path, model_name: str, dimensionality: int) -> Dict[str, tuple]:
+    """Loads stored product embeddings as a product ID -> (text hash, vector) mapping.
+
+    Returns an empty mapping if the file does not exist or was produced with a
+    different embedding model or dimensionality.
+    """
+    try:
+        with np.load(file_path) as stored:
+            if str(stored["model_name"]) != model_name or int(stored["dimensionality"]) != dimensionality:
+                logger.warning(
+                    "Stored product embeddings in %s do not match %s (%s dims); ignoring them.",
+                    file_path, model_name, dimensionality
+                )
+                return {}
+            return {
+                str(product_id): (str(text_hash), vector)
+                for product_id, text_hash, vector in zip(stored["product_ids"], stored["text_hashes"], stored["embeddings"])
+            }
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning("Could not load stored product embeddings from %s: %s", file_path, e)
+        return {}
+
+
+async def embed_texts(
+        gemini_client: genai.Client,
+        texts: List[str],
+        model_name: str,
+        task_type: str,
+        dimensionality: int
+) -> np.ndarray:
+    """Embeds texts with a Gemini embedding model.
+
+    Returns:
+        A float32 array of shape `(len(texts), dimensionality)` whose rows are
+        L2-normalized, so inner product equals cosine similarity.
+    """
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_REQUEST_BATCH_SIZE):
+        response = await gemini_client.aio.models.embed_content(
+            model=model_name,
+            contents=texts[start:start + EMBEDDING_REQUEST_BATCH_SIZE],
+            config=genai_types.EmbedContentConfig(task_type=task_type, output_dimensionality=dimensionality)
+        )
+        vectors.extend(embedding.values for embedding in response.embeddings)
+    return normalize_embeddings(vectors)
+
+
+def create_faiss_index(
+        embeddings: np.ndarray,
+        index_type: str = "flat",
+        nlist: int = 1024,
+        pq_m: int = 16,
+        pq_nbits: int = 8,
+        nprobe: int = 16,
+        hnsw_m: int = 32,
+        ef_construction: int = 40,
+        ef_search: int = 64
+) -> faiss.Index:
+    """Creates an inner-product FAISS index over L2-normalized embeddings.
+
+    Args:
+        embeddings: Float32 array of shape `(N, d)` with normalized rows.
+        index_type: "flat" for exact search, or "ivfpq" to cluster vectors into
+                    `nlist` inverted lists and compress them with product
+                    quantization (`pq_m` sub-vectors of `pq_nbits` bits each).
+                    "ivfpq" falls back to "flat" when there are too few vectors
+                    to train it. "hnsw" builds an HNSW graph for sub-linear search
+                    over uncompressed vectors.
+        nlist: Number of IVF lists for "ivfpq".
+        pq_m: Number of PQ sub-vectors for "ivfpq"; must divide the dimensionality.
+        pq_nbits: Bits per PQ sub-vector code for "ivfpq".
+        nprobe: Number of IVF lists visited per search for "ivfpq".
+        hnsw_m: Number of graph neighbours per vector for "hnsw".
+        ef_construction: Candidate list size while building the "hnsw" graph.
+        ef_search: Candidate list size per search for "hnsw"; higher is more
+                   accurate but slower.
+    """
+    count, dimensionality = embeddings.shape
+    if index_type == "ivfpq":
+        min_training_points = MIN_TRAINING_POINTS_PER_CENTROID * max(nlist, 2 ** pq_nbits)
+        if count >= min_training_points:
+            quantizer = faiss.IndexFlatIP(dimensionality)
+            index = faiss.IndexIVFPQ(quantizer, dimensionality, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+            index.train(embeddings)
+            index.add(embeddings)
+            index.nprobe = nprobe
+            return index
+        logger.info(
+            "%s product vectors are too few to train an IVF-PQ index (need %s); using a flat index.",
+            count, min_training_points
+        )
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensionality, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.add(embeddings)
+        index.hnsw.efSearch = ef_search
+        return index
+    elif index_type != "flat":
+        raise ValueError(f"Unknown product index type: {index_type}")
+
+    index = faiss.IndexFlatIP(dimensionality)
+    index.add(embeddings)
+    return index
+
+
+class ProductVectorIndex:
+    """Nearest-neighbour lookup from free text to catalog products.
+
+    Product embeddings are computed once and kept in a FAISS inner-product index,
+    so matching a query costs one embedding call plus a local k-NN search instead
+    of an LLM call over the whole catalog.
+    """
+
+    def __init__(self, index: faiss.Index, product_ids: List[str], model_name: str, dimensionality: int):
+        self.index = index
+        self.product_ids = product_ids
+        self.model_name = model_name
+        self.dimensionality = dimensionality
+
+    @classmethod
+    async def build(
+            cls,
+            gemini_client: genai.Client,
+            products_db: List[Dict],
+            model_name: str,
+            dimensionality: int,
+            embeddings_path: Optional[Path] = None,
+            **index_options
+    ) -> "ProductVectorIndex":
+        """Builds the index over every product with an ID.
+
+        Embeddings stored at `embeddings_path` (see `build_product_embeddings.py`)
+        are reused for products whose text has not changed; only the remaining
+        products are embedded online. `index_options` are passed to
+        `create_faiss_index`.
+        """
+        products = [p for p in products_db if p.get("id")]
+        stored = load_product_embeddings(embeddings_path, model_name, dimensionality) if embeddings_path else {}
+
+        embeddings = np.empty((len(products), dimensionality), dtype=np.float32)
+        missing_rows = []
+        for row, product in enumerate(products):
+            stored_entry = stored.get(product["id"])
+            if stored_entry is not None and stored_entry[0] == product_text_hash(product):
+                embeddings[row] = stored_entry[1]
+            else:
+                missing_rows.append(row)
+
+        if stored:
+            logger.info(
+                "Reusing %s stored product embeddings; embedding %s new or changed products.",
+                len(products) - len(missing_rows), len(missing_rows)
+            )
+        if missing_rows:
+            embeddings[missing_rows] = await embed_texts(
+                gemini_client,
+                [product_embedding_text(products[row]) for row in missing_rows],
+                model_name,
+                "RETRIEVAL_DOCUMENT",
+                dimensionality
+            )
+
+        # Training IVF-PQ or building an HNSW graph is CPU-heavy; keep it off the event loop
+        index = await asyncio.to_thread(create_faiss_index, embeddings, **index_options)
+        return cls(index, [p["id"] for p in products], model_name, dimensionality)
+
+    async def search(self, gemini_client: genai.Client, query: str, top_k: int, min_score: float = 0.0) -> List[str]:
+        """Returns the IDs of the products closest to the query, best match first.
+
+        Args:
+            gemini_client: Initialized Gemini API client, used to embed the query.
+            query: Free-text query, e.g. a description of an uploaded image.
+            top_k: Maximum number of product IDs to return.
+            min_score: Minimum cosine similarity for a product to be returned.
+        """
+        return (await self.search_many(gemini_client, [query], top_k, min_score))[0]
+
+    async def search_many(
+            self,
+            gemini_client: genai.Client,
+            queries: List[str],
+            top_k: int,
+            min_score: float = 0.0,
+            query_embeddings: Optional[np.ndarray] = None
+    ) -> List[List[str]]:
+        """Like `search`, for several queries embedded in one request; returns one ID list per query.
+
+        `query_embeddings` may hold the queries' normalized `RETRIEVAL_QUERY` embeddings,
+        one row per query, when the caller already has them; otherwise they are computed here.
+        """
+        if query_embeddings is None:
+            query_embeddings = await embed_texts(
+                gemini_client, queries, self.model_name, "RETRIEVAL_QUERY", self.dimensionality
+            )
+        # FAISS releases the GIL while searching, so large indexes don't stall the event loop
+        scores, indices = await asyncio.to_thread(self.index.search, query_embeddings, min(top_k, self.index.ntotal))
+        return [
+            [self.product_ids[i] for score, i in zip(query_scores, query_indices) if i != -1 and score >= min_score]
+            for query_scores, query_indices in zip(scores, indices)
+        ]
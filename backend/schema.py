@@ -29,4 +29,30 @@ class TextRecommendQuery(BaseModel):
 
 class RecommendationResponse(BaseModel):
     recommendations: List[Product]
-    message: Optional[str] = None
\ No newline at end of file
+    message: Optional[str] = None
+
+class BatchJobResponse(BaseModel):
+    job_name: str
+    state: str
+
+class BatchRecommendationResult(BaseModel):
+    key: str
+    recommendations: List[Product]
+    message: Optional[str] = None
+
+class BatchRecommendationResultsResponse(BaseModel):
+    job_name: str
+    state: str
+    results: List[BatchRecommendationResult] = []
+
+class LLMQueryRecommendation(BaseModel):
+    query_number: int
+    product_ids: List[str]
+
+class LLMImageDescription(BaseModel):
+    image_number: int
+    description: str
+
+class LLMImageRecommendation(BaseModel):
+    description: str
+    product_ids: List[str]
\ No newline at end of file
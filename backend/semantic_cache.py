@@ -0,0 +1,45 @@
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    """Fixed-size cache keyed by L2-normalized query embeddings.
+
+    A lookup returns the value of the most similar live entry when its cosine
+    similarity reaches `similarity_threshold`, so paraphrased queries ("cheap red
+    shirt" / "red shirt cheap") share a result. Entries expire after `ttl_seconds`;
+    once the cache is full, the oldest entry is overwritten.
+    """
+
+    def __init__(self, max_size: int, dimensionality: int, similarity_threshold: float, ttl_seconds: int):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self._embeddings = np.zeros((max_size, dimensionality), dtype=np.float32)
+        self._expires_at = np.zeros(max_size, dtype=np.float64)
+        self._values = [None] * max_size
+        self._next_slot = 0
+
+    def get(self, embedding: np.ndarray) -> Optional[Any]:
+        """Returns the cached value for the most similar query, or `None` if none is similar enough."""
+        scores = self._embeddings @ embedding
+        scores[self._expires_at <= time.monotonic()] = -np.inf
+        best_slot = int(np.argmax(scores))
+        if scores[best_slot] < self.similarity_threshold:
+            return None
+        return self._values[best_slot]
+
+    def set(self, embedding: np.ndarray, value: Any) -> None:
+        """Stores a value for a query embedding, replacing the oldest entry if the cache is full."""
+        slot = self._next_slot
+        self._embeddings[slot] = embedding
+        self._expires_at[slot] = time.monotonic() + self.ttl_seconds
+        self._values[slot] = value
+        self._next_slot = (slot + 1) % len(self._values)
+
+    def clear(self) -> None:
+        """Removes all entries."""
+        self._expires_at[:] = 0
+        self._values = [None] * len(self._values)
+        self._next_slot = 0
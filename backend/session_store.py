@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import weakref
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional
+
+import orjson
+from cachetools import TTLCache
+from google.genai import types as genai_types
+from google.genai.chats import AsyncChat
+from redis import asyncio as redis_asyncio
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__name__)
+
+# Builds a chat for the configured model, optionally seeded with an existing history
+ChatFactory = Callable[[Optional[List[genai_types.Content]]], AsyncChat]
+
+
+class SessionLockTimeoutError(Exception):
+    """Raised when another turn on the same session holds its lock for too long."""
+
+
+class SessionStore(ABC):
+    """Storage for chat sessions, shared by the chat endpoints.
+
+    A turn takes the session's `lock`, loads the chat with `load_chat`, sends the
+    message and stores the updated chat with `save_chat`, which also refreshes
+    the session's TTL.
+    """
+
+    @abstractmethod
+    async def load_chat(self, session_id: str, create_chat: ChatFactory) -> Optional[AsyncChat]:
+        """Returns the chat for a session, or `None` if the session does not exist or has expired."""
+
+    @abstractmethod
+    async def save_chat(self, session_id: str, chat: AsyncChat) -> None:
+        """Stores the chat for a session and resets its TTL."""
+
+    @abstractmethod
+    def lock(self, session_id: str):
+        """Returns an async context manager that serializes turns on a session.
+
+        Raises:
+            SessionLockTimeoutError: On entry, if the lock could not be acquired in time.
+        """
+
+    async def close(self) -> None:
+        """Releases the store's resources."""
+
+
+class InMemorySessionStore(SessionStore):
+    """Keeps chat session histories in a bounded TTL cache inside this process.
+
+    Like `RedisSessionStore`, only the curated message history is kept, not the
+    live chat object, and each turn rehydrates a chat from it. Sessions are only
+    visible to the worker that created them; use `RedisSessionStore` when running
+    several workers.
+    """
+
+    def __init__(self, max_sessions: int, ttl_seconds: int, lock_wait_seconds: float = 30):
+        self.histories = TTLCache(maxsize=max_sessions, ttl=ttl_seconds)
+        self.lock_wait_seconds = lock_wait_seconds
+        # Locks are dropped automatically once no request is holding or waiting on them
+        self.locks = weakref.WeakValueDictionary()
+
+    async def load_chat(self, session_id: str, create_chat: ChatFactory) -> Optional[AsyncChat]:
+        history = self.histories.get(session_id)
+        return None if history is None else create_chat(list(history))
+
+    async def save_chat(self, session_id: str, chat: AsyncChat) -> None:
+        # Re-insert to refresh the session's TTL
+        self.histories[session_id] = tuple(chat.get_history(curated=True))
+
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        """Holds the session's lock, waiting up to `lock_wait_seconds` to acquire it."""
+        lock = self.locks.get(session_id)
+        if lock is None:
+            lock = self.locks[session_id] = asyncio.Lock()
+        try:
+            async with asyncio.timeout(self.lock_wait_seconds):
+                await lock.acquire()
+        except TimeoutError:
+            raise SessionLockTimeoutError(f"Timed out waiting for the lock on session {session_id}.") from None
+        try:
+            yield
+        finally:
+            lock.release()
+
+    async def close(self) -> None:
+        self.histories.clear()
+
+
+class RedisSessionStore(SessionStore):
+    """Persists chat session histories in Redis so any worker can serve any session.
+
+    Only the serializable message history is stored, never the live chat object.
+    Each turn rehydrates a chat from the stored history and writes the new
+    history back, refreshing the key's TTL. Turns on the same session are
+    serialized across workers with `lock`.
+    """
+
+    def __init__(
+            self,
+            redis_client: redis_asyncio.Redis,
+            ttl_seconds: int,
+            key_prefix: str = "session:",
+            lock_timeout_seconds: float = 120,
+            lock_wait_seconds: float = 30
+    ):
+        self.redis_client = redis_client
+        self.ttl_seconds = ttl_seconds
+        self.key_prefix = key_prefix
+        self.lock_timeout_seconds = lock_timeout_seconds
+        self.lock_wait_seconds = lock_wait_seconds
+
+    @classmethod
+    def from_url(cls, redis_url: str, ttl_seconds: int, max_connections: int = 100, **options) -> "RedisSessionStore":
+        """Creates a store backed by a Redis connection pool for the given URL."""
+        return cls(redis_asyncio.from_url(redis_url, max_connections=max_connections), ttl_seconds, **options)
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+
+    async def load_history(self, session_id: str) -> Optional[List[genai_types.Content]]:
+        """Returns the stored chat history for a session, or `None` if the session does not exist."""
+        raw_history = await self.redis_client.get(self._key(session_id))
+        if raw_history is None:
+            return None
+        return [genai_types.Content.model_validate(content) for content in orjson.loads(raw_history)]
+
+    async def save_history(self, session_id: str, history: List[genai_types.Content]) -> None:
+        """Stores the chat history for a session and resets its TTL."""
+        raw_history = orjson.dumps([content.model_dump(mode="json", exclude_none=True) for content in history])
+        await self.redis_client.set(self._key(session_id), raw_history, ex=self.ttl_seconds)
+
+    async def load_chat(self, session_id: str, create_chat: ChatFactory) -> Optional[AsyncChat]:
+        history = await self.load_history(session_id)
+        return None if history is None else create_chat(history)
+
+    async def save_chat(self, session_id: str, chat: AsyncChat) -> None:
+        await self.save_history(session_id, chat.get_history(curated=True))
+
+    @asynccontextmanager
+    async def lock(self, session_id: str) -> AsyncIterator[None]:
+        """Holds a Redis lock (SET NX with expiry) on a session's history.
+
+        The lock expires after `lock_timeout_seconds` so a crashed worker cannot
+        block the session forever; acquiring it waits up to `lock_wait_seconds`.
+        """
+        lock = self.redis_client.lock(
+            f"{self._key(session_id)}:lock",
+            timeout=self.lock_timeout_seconds,
+            blocking_timeout=self.lock_wait_seconds
+        )
+        if not await lock.acquire():
+            raise SessionLockTimeoutError(f"Timed out waiting for the lock on session {session_id}.")
+        try:
+            yield
+        finally:
+            try:
+                await lock.release()
+            except LockError as e:
+                logger.warning("Lock on session %s expired before the turn finished: %s", session_id, e)
+
+    async def close(self) -> None:
+        """Closes the underlying Redis connection pool."""
+        await self.redis_client.aclose()
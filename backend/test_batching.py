@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+
+from batching import AsyncBatcher
+
+
+class AsyncBatcherTest(unittest.IsolatedAsyncioTestCase):
+    """Run from backend/ with `python -m unittest test_batching`."""
+
+    async def asyncSetUp(self):
+        self.batches = []
+
+    async def _echo(self, items):
+        self.batches.append(list(items))
+        return [item * 10 for item in items]
+
+    async def _start(self, process_batch, **options):
+        batcher = AsyncBatcher(process_batch, **options)
+        batcher.start()
+        self.addAsyncCleanup(batcher.stop, 1)
+        return batcher
+
+    async def test_results_follow_item_order(self):
+        batcher = await self._start(self._echo, max_batch_size=8, max_queue_time=0.05)
+        results = await asyncio.gather(*(batcher.process(i) for i in range(5)))
+        self.assertEqual(results, [0, 10, 20, 30, 40])
+        self.assertEqual(self.batches, [[0, 1, 2, 3, 4]])
+
+    async def test_batch_closes_at_max_size(self):
+        batcher = await self._start(self._echo, max_batch_size=2, max_queue_time=0.05)
+        await asyncio.gather(*(batcher.process(i) for i in range(5)))
+        self.assertEqual(self.batches, [[0, 1], [2, 3], [4]])
+
+    async def test_weight_limit_carries_item_over(self):
+        batcher = await self._start(
+            self._echo, max_batch_size=8, max_queue_time=0.05, item_weight=lambda item: item, max_batch_weight=5
+        )
+        results = await asyncio.gather(*(batcher.process(i) for i in (2, 3, 4, 9)))
+        self.assertEqual(results, [20, 30, 40, 90])
+        # 4 does not fit next to 2 + 3, and 9 exceeds the limit on its own
+        self.assertEqual(self.batches, [[2, 3], [4], [9]])
+
+    async def test_exception_result_fails_only_its_item(self):
+        async def process_batch(items):
+            return [ValueError(f"bad {item}") if item == 1 else item for item in items]
+
+        batcher = await self._start(process_batch, max_batch_size=8, max_queue_time=0.05)
+        results = await asyncio.gather(*(batcher.process(i) for i in range(3)), return_exceptions=True)
+        self.assertEqual(results[0], 0)
+        self.assertIsInstance(results[1], ValueError)
+        self.assertEqual(results[2], 2)
+
+    async def test_failed_batch_fails_every_item(self):
+        async def process_batch(items):
+            raise RuntimeError("boom")
+
+        batcher = await self._start(process_batch, max_batch_size=8, max_queue_time=0.05)
+        results = await asyncio.gather(*(batcher.process(i) for i in range(3)), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+    async def test_stop_waits_for_in_flight_batch(self):
+        async def process_batch(items):
+            await asyncio.sleep(0.05)
+            return items
+
+        batcher = await self._start(process_batch, max_batch_size=8, max_queue_time=0.01)
+        pending = asyncio.ensure_future(batcher.process(1))
+        await asyncio.sleep(0.02)
+        await batcher.stop(timeout=1)
+        self.assertEqual(await pending, 1)
+
+    async def test_stop_cancels_batch_past_timeout(self):
+        async def process_batch(items):
+            await asyncio.sleep(10)
+            return items
+
+        batcher = await self._start(process_batch, max_batch_size=8, max_queue_time=0.01)
+        pending = asyncio.ensure_future(batcher.process(1))
+        await asyncio.sleep(0.02)
+        await batcher.stop(timeout=0.05)
+        with self.assertRaises(RuntimeError):
+            await pending
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,110 +1,360 @@
+import asyncio
+import io
 import json
-from typing import List, Dict, Tuple, Optional
+import logging
+import mmap
+import re
+import string
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Iterable, List, Dict, Set, Tuple, Optional
 from pathlib import Path
 
+import orjson
 from fastapi import UploadFile, HTTPException
 from google import genai
 from google.genai import types as genai_types
 from pydantic import ValidationError
-from schema import Product
+from schema import Product, LLMQueryRecommendation, LLMImageDescription, LLMImageRecommendation
+
+logger = logging.getLogger(__name__)
+
+_catalog_cache_lock = asyncio.Lock()
+
+# Recommendation prompts ask for at most this many product IDs
+MAX_RECOMMENDED_PRODUCTS = 3
+
+# Batch Mode jobs submitted by this service carry this display name; other jobs are not served
+RECOMMENDATION_BATCH_DISPLAY_NAME = "recommend-text-batch"
+BATCH_JOB_NAME_PATTERN = re.compile(r"batches/[A-Za-z0-9_-]+")
+
+# Product ID tokens in a reply that is not a JSON array, e.g. `prod101, prod205`
+PRODUCT_ID_PATTERN = re.compile(r"[A-Za-z0-9_\-]+")
+
+# Number of leading bytes needed to recognize every supported image format
+IMAGE_SIGNATURE_BYTES = 12
+HEIC_BRANDS = {b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx"}
+HEIF_BRANDS = {b"mif1", b"msf1", b"heif"}
 
 def load_products_from_file(file_path: Path) -> List:
     """Loads product data from the JSON file specified in settings."""
     try:
-        with open(file_path, 'r') as f:
-            products = json.load(f)
-            print(f"INFO: Successfully loaded {len(products)} products from {file_path}")
+        with open(file_path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                products = orjson.loads(view)
+            logger.info("Successfully loaded %s products from %s", len(products), file_path)
             return products
     except FileNotFoundError:
-        print(f"ERROR: Product file not found at {file_path}. Returning empty list.")
+        logger.error("Product file not found at %s. Returning empty list.", file_path)
         return []
-    except json.JSONDecodeError:
-        print(f"ERROR: Error decoding JSON from {file_path}. Returning empty list.")
+    except orjson.JSONDecodeError:
+        logger.error("Error decoding JSON from %s. Returning empty list.", file_path)
         return []
     except Exception as e:
-        print(f"ERROR: An unexpected error occurred while loading products: {e}")
+        logger.error("An unexpected error occurred while loading products: %s", e)
         return []
 
-def format_products_for_llm(products_db: List[Dict]) -> str:
+def _compact_field(value: str) -> str:
+    """Removes the separators used by the compact product format from a field value."""
+    return " ".join(str(value).replace("|", " ").split())
+
+def format_product_for_llm(p: Dict, description_max_chars: int = 160) -> str:
+    """Formats one product as a compact `id|name|description|tags` line with a truncated description."""
+    tags_str = ','.join(_compact_field(tag) for tag in p.get('tags', []))
+    return (
+        f"{_compact_field(p.get('id', 'N/A'))}|{_compact_field(p.get('name', 'N/A'))}|"
+        f"{_compact_field(p.get('description', 'N/A'))[:description_max_chars]}|{tags_str}"
+    )
+
+def format_product_lines_for_llm(products_db: List[Dict], description_max_chars: int = 160) -> Dict[str, str]:
+    """Formats each product with an ID once, as a product ID -> compact line mapping in catalog order."""
+    return {p["id"]: format_product_for_llm(p, description_max_chars) for p in products_db if p.get("id")}
+
+def format_products_for_llm(product_lines: Iterable[str]) -> str:
     """
-    Formats all products from the database for LLM context.
+    Joins formatted product lines (see `format_product_lines_for_llm`) into the
+    catalog context sent to the LLM, one compact `id|name|description|tags` line per product.
+    """
+    return "\n".join(product_lines) or "No product information available."
+
+def compile_prompt_template(template: str) -> Callable[..., str]:
+    """Parses a `str.format` template once into literal chunks and field names.
+
+    The returned function renders the template from keyword arguments by joining
+    the chunks, without re-parsing the template on every call. Only plain
+    `{field}` placeholders are supported.
     """
-    if not products_db:
-        return "No product information available."
+    chunks: List[Tuple[bool, str]] = []
+    for literal_text, field_name, format_spec, conversion in string.Formatter().parse(template):
+        if literal_text:
+            chunks.append((True, literal_text))
+        if field_name is not None:
+            if not field_name.isidentifier() or format_spec or conversion:
+                raise ValueError(f"Unsupported placeholder in prompt template: {{{field_name}}}")
+            chunks.append((False, field_name))
+
+    def render(**fields) -> str:
+        return "".join(text if is_literal else str(fields[text]) for is_literal, text in chunks)
+    return render
+
+@lru_cache(maxsize=1024)
+def _format_user_profile_items(profile_items: Tuple[Tuple[str, object], ...]) -> str:
+    return ", ".join(f"{k}: {v}" for k, v in profile_items)
+
+def format_user_profile(user_profile: Dict) -> str:
+    """Formats a user profile as `key: value` pairs; memoized since most sessions share a profile."""
+    try:
+        return _format_user_profile_items(tuple(user_profile.items()))
+    except TypeError:
+        # Profiles with unhashable values (e.g. lists) cannot be memoized
+        return ", ".join(f"{k}: {v}" for k, v in user_profile.items())
+
+def build_products_index(products_db: List[Dict]) -> Dict[str, Product]:
+    """Validates each product once and builds a product ID -> `Product` index for O(1) lookups.
 
-    product_texts = []
+    Products that fail validation are logged and left out of the index.
+    """
+    products_by_id = {}
     for p in products_db:
-        tags_str = ', '.join(p.get('tags', []))
-        product_texts.append(
-            f"ID: {p.get('id', 'N/A')}, Name: {p.get('name', 'N/A')}, "
-            f"Description: {p.get('description', 'N/A')}, Tags: {tags_str}"
-        )
-    return "\n".join(product_texts)
+        if not p.get("id"):
+            continue
+        try:
+            products_by_id[p["id"]] = Product(**p)
+        except ValidationError as ve:
+            logger.error("Validation error creating Product object for ID %s: %s. Data: %s", p['id'], ve, p)
+    return products_by_id
 
 def parse_llm_product_ids_and_fetch(
         llm_response_text: str,
-        products_db: List[Dict]
+        products_by_id: Dict[str, Product]
 ) -> Tuple[List[Product], str]:
     """
-    Parses LLM output for product IDs, fetches product details from products_db,
-    and generates a corresponding status message segment.
+    Parses a JSON array of product IDs returned by the LLM and fetches the products.
+
+    A reply that is not a JSON array (e.g. a bare comma-separated list) is scanned
+    for known product IDs instead of being discarded.
 
     Args:
-        llm_response_text: The text response from the LLM, expected to be
-                           comma-separated product IDs or "NOMATCH".
-        products_db: A list of dictionaries, where each dictionary represents a product
-                     and contains at least an "id" key.
+        llm_response_text: The text response from the LLM, expected to be a
+                           JSON array of product IDs (empty when nothing matches).
+        products_by_id: A dictionary mapping product IDs to validated `Product` objects.
 
     Returns:
         A tuple containing:
             - A list of successfully parsed and fetched Product objects.
             - A string message segment indicating the outcome.
     """
-    if not llm_response_text or llm_response_text.strip().upper() == "NOMATCH":
+    try:
+        recommended_ids = orjson.loads(llm_response_text) if llm_response_text else []
+    except orjson.JSONDecodeError:
+        recommended_ids = None
+    if not isinstance(recommended_ids, list):
+        logger.warning(
+            "LLM response is not a JSON array of product IDs (%s chars), scanning it for IDs: '%.80s'",
+            len(llm_response_text), llm_response_text
+        )
+        logger.debug("Full non-JSON LLM response: '%s'", llm_response_text)
+        # Lazily yields known IDs; fetching stops after the first few, so long replies are never fully scanned
+        recommended_ids = (
+            match.group() for match in PRODUCT_ID_PATTERN.finditer(llm_response_text)
+            if match.group() in products_by_id
+        )
+    return fetch_recommended_products(recommended_ids, products_by_id)
+
+def fetch_recommended_products(
+        recommended_ids: Iterable[str],
+        products_by_id: Dict[str, Product],
+        max_products: int = MAX_RECOMMENDED_PRODUCTS
+) -> Tuple[List[Product], str]:
+    """
+    Fetches product details for LLM-recommended IDs from products_by_id
+    and generates a corresponding status message segment.
+
+    Args:
+        recommended_ids: Product IDs recommended by the LLM, in order.
+        products_by_id: A dictionary mapping product IDs to validated `Product` objects.
+        max_products: Only the first `max_products` distinct IDs are considered, so an
+                      oversized LLM reply cannot inflate the per-request work.
+
+    Returns:
+        A tuple containing:
+            - A list of successfully fetched Product objects.
+            - A string message segment indicating the outcome.
+    """
+    if not recommended_ids:
         return [], " I couldn't find specific products matching that description in our current selection..."
 
-    raw_ids = llm_response_text.split(',')
-    recommended_ids = [id_str.strip() for id_str in raw_ids if id_str.strip()]
+    distinct_ids = {}
+    for id_str in recommended_ids:
+        prod_id = str(id_str).strip()
+        if prod_id:
+            distinct_ids[prod_id] = None
+            if len(distinct_ids) == max_products:
+                break
+    recommended_ids = list(distinct_ids)
 
     if not recommended_ids:
         return [], " I wasn't able to pinpoint specific recommendations from the response received..."
 
-    # products_map = {p.get("id"): p for p in products_db if p.get("id")}
-    # used only for giant product_db
-
     recommended_products_details: List[Product] = []
-    found_product_data_for_any_id = False
-
     for prod_id in recommended_ids:
-        # used only for giant product_db
-        # product_data = products_map.get(prod_id)
-        product_data = next((p for p in products_db if p.get("id") == prod_id), None)
-
-        if product_data:
-            found_product_data_for_any_id = True
-            try:
-                recommended_products_details.append(Product(**product_data))
-            except ValidationError as ve:
-                print(f"ERROR: Validation error creating Product object for ID {prod_id}: {ve}. Data: {product_data}")
-            except Exception as e:
-                print(f"ERROR: Unexpected error creating Product object for ID {prod_id}: {e}. Data: {product_data}")
+        product = products_by_id.get(prod_id)
+        if product is not None:
+            recommended_products_details.append(product)
         else:
-            print(f"INFO: Product ID '{prod_id}' recommended by LLM but not found in products_db.")
+            logger.info("Product ID '%s' recommended by LLM but not found in products_by_id.", prod_id)
 
     if recommended_products_details:
         status_message_segment = " here are some recommendations:"
-    elif found_product_data_for_any_id:
-        status_message_segment = " I found some potential matches but couldn't fully process their details..."
     else:
         status_message_segment = " I looked for those product IDs but couldn't find them in our records..."
 
     return recommended_products_details, status_message_segment
 
+def sniff_image_mime_type(head: bytes) -> Optional[str]:
+    """Returns the MIME type of a JPEG, PNG, WebP or HEIC/HEIF image from its first bytes, or `None`."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp":
+        if head[8:12] in HEIC_BRANDS:
+            return "image/heic"
+        if head[8:12] in HEIF_BRANDS:
+            return "image/heif"
+    return None
+
+async def validate_image_upload(file: UploadFile, max_bytes: int, allowed_mime_types: List[str]) -> str:
+    """Checks an uploaded image's size, declared type and file signature before it is read in full.
+
+    Only the first few bytes are read; the file is rewound afterwards.
+
+    Returns:
+        The image MIME type detected from the file signature.
+
+    Raises:
+        HTTPException: 413 if the declared size exceeds `max_bytes`, 400 if the
+                       file is empty, 415 if it is not a supported image.
+    """
+    if file.size is not None and file.size > max_bytes:
+        logger.warning("Uploaded file %s is too large (%s bytes).", file.filename, file.size)
+        raise HTTPException(status_code=413, detail=f"Uploaded file is too large (limit is {max_bytes} bytes).")
+
+    declared_type = (file.content_type or "").split(";", 1)[0].strip().lower()
+    if declared_type not in allowed_mime_types:
+        logger.warning("Uploaded file %s has unsupported content type %s.", file.filename, file.content_type)
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported image type. Supported types: {', '.join(allowed_mime_types)}."
+        )
+
+    head = await file.read(IMAGE_SIGNATURE_BYTES)
+    await file.seek(0)
+    if not head:
+        logger.warning("Uploaded file %s is empty.", file.filename)
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+
+    detected_type = sniff_image_mime_type(head)
+    if detected_type not in allowed_mime_types:
+        logger.warning("Uploaded file %s declared as %s is not a supported image.", file.filename, declared_type)
+        raise HTTPException(status_code=415, detail="Uploaded file is not a valid image.")
+    return detected_type
+
+async def read_upload_file(file: UploadFile, max_bytes: int) -> bytes:
+    """Reads an uploaded file with a single bounded read, rejecting it if it exceeds `max_bytes`.
+
+    The upload is already spooled by the time the endpoint runs, so one read of at
+    most `max_bytes + 1` bytes avoids growing and then copying an accumulation buffer.
+
+    Raises:
+        HTTPException: 413 if the file is larger than `max_bytes`, 400 if it is empty.
+    """
+    if file.size is not None and file.size > max_bytes:
+        logger.warning("Uploaded file %s is too large (%s bytes).", file.filename, file.size)
+        raise HTTPException(status_code=413, detail=f"Uploaded file is too large (limit is {max_bytes} bytes).")
+
+    contents = await file.read(max_bytes + 1)
+    if len(contents) > max_bytes:
+        logger.warning("Uploaded file %s exceeds %s bytes.", file.filename, max_bytes)
+        raise HTTPException(status_code=413, detail=f"Uploaded file is too large (limit is {max_bytes} bytes).")
+
+    if not contents:
+        logger.warning("Uploaded file %s is empty.", file.filename)
+        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    return contents
+
+def build_generation_config(**options) -> Optional[genai_types.GenerateContentConfig]:
+    """Builds a GenerateContentConfig from the options that are set, or `None` if none are."""
+    options = {name: value for name, value in options.items() if value is not None}
+    return genai_types.GenerateContentConfig(**options) if options else None
+
+async def create_catalog_cache(
+        gemini_client: genai.Client,
+        model_name: str,
+        catalog_text: str,
+        ttl_seconds: int
+) -> Optional[genai_types.CachedContent]:
+    """Registers the static product catalog as Gemini cached content for a model.
+
+    Returns:
+        The created `CachedContent`, or `None` if caching is not available
+        (e.g. the model does not support it or the catalog is below the
+        minimum cacheable token count). Callers then send the catalog inline.
+    """
+    try:
+        cached_content = await gemini_client.aio.caches.create(
+            model=model_name,
+            config=genai_types.CreateCachedContentConfig(
+                display_name="product-catalog",
+                contents=[catalog_text],
+                ttl=f"{ttl_seconds}s"
+            )
+        )
+        logger.info("Created catalog context cache %s for model %s.", cached_content.name, model_name)
+        return cached_content
+    except Exception as e:
+        logger.warning("Could not create catalog context cache for model %s, sending catalog inline: %s", model_name, e)
+        return None
+
+async def resolve_catalog_cache_name(
+        gemini_client: genai.Client,
+        catalog_caches: Dict[str, Optional[genai_types.CachedContent]],
+        model_name: str,
+        catalog_text: str,
+        ttl_seconds: int,
+        refresh_margin_seconds: int
+) -> Optional[str]:
+    """Returns the cached content name for a model, recreating it if it is about to expire.
+
+    Models whose cache could not be created are stored as `None` and are not retried,
+    so an unsupported model does not cost an extra API call on every request.
+    """
+    if model_name not in catalog_caches or catalog_caches[model_name] is None:
+        return None
+
+    refresh_deadline = datetime.now(timezone.utc) + timedelta(seconds=refresh_margin_seconds)
+    cached_content = catalog_caches[model_name]
+    if cached_content.expire_time is None or cached_content.expire_time > refresh_deadline:
+        return cached_content.name
+
+    async with _catalog_cache_lock:
+        cached_content = catalog_caches.get(model_name)
+        if cached_content is not None and cached_content.expire_time is not None \
+                and cached_content.expire_time <= refresh_deadline:
+            logger.info("Catalog context cache for model %s is expiring, recreating it.", model_name)
+            cached_content = await create_catalog_cache(gemini_client, model_name, catalog_text, ttl_seconds)
+            catalog_caches[model_name] = cached_content
+    return cached_content.name if cached_content is not None else None
+
 async def _get_recommendations_from_llm(
         prompt: str,
         model_name: str,
         gemini_client: genai.Client,
-        products_db: List[Dict]
+        products_by_id: Dict[str, Product],
+        cached_content: Optional[str] = None,
+        service_tier: Optional[str] = None
 ) -> (List[Product], str):
     """Sends a prompt to a Gemini model and processes the response for product recommendations.
 
@@ -112,69 +362,354 @@ async def _get_recommendations_from_llm(
         prompt: Text prompt for the language model.
         model_name: Name of the Gemini model to use.
         gemini_client: Initialized Gemini API client.
-        products_db: List of product dictionaries for detail fetching.
+        products_by_id: Product ID -> validated `Product` index.
+        cached_content: Optional name of the cached catalog context to reference.
+        service_tier: Optional Gemini service tier (e.g. "flex") for the request.
 
     Returns:
         A tuple containing a list of `Product` objects and a message segment string,
         or `None` if an error occurs during the LLM call.
     """
     try:
-        response = gemini_client.models.generate_content(
+        response = await gemini_client.aio.models.generate_content(
             model=model_name,
-            contents=[prompt]
+            contents=[prompt],
+            config=build_generation_config(
+                response_mime_type="application/json",
+                response_schema=list[str],
+                cached_content=cached_content,
+                service_tier=service_tier
+            )
         )
         llm_response_text = response.text.strip()
-        print(f"INFO: LLM response for model {model_name}: '{llm_response_text}'")
-        return parse_llm_product_ids_and_fetch(llm_response_text, products_db)
+        logger.debug("LLM response for model %s: '%s'", model_name, llm_response_text)
+        return parse_llm_product_ids_and_fetch(llm_response_text, products_by_id)
     except Exception as e:
-        print(f"ERROR: Error during LLM call with model {model_name}: {e}")
+        logger.error("Error during LLM call with model %s: %s", model_name, e)
         raise
 
 
+async def _get_batched_recommendations_from_llm(
+        prompt: str,
+        query_count: int,
+        model_name: str,
+        gemini_client: genai.Client,
+        products_by_id: Dict[str, Product],
+        cached_content: Optional[str] = None,
+        service_tier: Optional[str] = None,
+        allowed_ids_by_query: Optional[List[Set[str]]] = None
+) -> List[Optional[Tuple[List[Product], str]]]:
+    """Sends a multi-query prompt to a Gemini model and splits the response per query.
+
+    Args:
+        prompt: Text prompt listing the numbered queries (1-based).
+        query_count: Number of queries in the prompt.
+        model_name: Name of the Gemini model to use.
+        gemini_client: Initialized Gemini API client.
+        products_by_id: Product ID -> validated `Product` index.
+        cached_content: Optional name of the cached catalog context to reference.
+        service_tier: Optional Gemini service tier (e.g. "flex") for the request.
+        allowed_ids_by_query: Optional candidate product IDs per query, in query order;
+                              IDs the response gives a query outside its own candidates
+                              are dropped, so one query cannot steer another's results.
+
+    Returns:
+        One `(products, message segment)` tuple per query, in query order, or
+        `None` for a query the response left out, which is not the same as no match.
+    """
+    try:
+        response = await gemini_client.aio.models.generate_content(
+            model=model_name,
+            contents=[prompt],
+            config=build_generation_config(
+                response_mime_type="application/json",
+                response_schema=list[LLMQueryRecommendation],
+                cached_content=cached_content,
+                service_tier=service_tier
+            )
+        )
+        logger.debug("Batched LLM response for %s queries with model %s: '%s'", query_count, model_name, response.text)
+        ids_by_query = {
+            entry.query_number: entry.product_ids
+            for entry in map(LLMQueryRecommendation.model_validate, orjson.loads(response.text))
+        }
+        missing = [query_number for query_number in range(1, query_count + 1) if query_number not in ids_by_query]
+        if missing:
+            logger.warning("Batched LLM response for %s queries left out queries %s.", query_count, missing)
+        if allowed_ids_by_query is not None:
+            for query_number, product_ids in ids_by_query.items():
+                if 1 <= query_number <= query_count:
+                    allowed_ids = allowed_ids_by_query[query_number - 1]
+                    ids_by_query[query_number] = [
+                        product_id for product_id in product_ids if product_id in allowed_ids
+                    ]
+        return [
+            fetch_recommended_products(ids_by_query[query_number], products_by_id)
+            if query_number in ids_by_query else None
+            for query_number in range(1, query_count + 1)
+        ]
+    except Exception as e:
+        logger.error("Error during batched LLM call with model %s: %s", model_name, e)
+        raise
+
+
+async def _submit_batch_recommendations_to_llm(
+        prompts: List[str],
+        model_name: str,
+        gemini_client: genai.Client
+) -> genai_types.BatchJob:
+    """Uploads prompts as a JSONL file and submits them as a Gemini Batch Mode job.
+
+    Args:
+        prompts: Text prompts, one per recommendation query. Each is keyed
+                 as `req_<index>` in the batch input.
+        model_name: Name of the Gemini model to use.
+        gemini_client: Initialized Gemini API client.
+
+    Returns:
+        The created `BatchJob`.
+    """
+    generation_config = {
+        "responseMimeType": "application/json",
+        "responseSchema": {"type": "ARRAY", "items": {"type": "STRING"}}
+    }
+    jsonl_lines = [
+        json.dumps({
+            "key": f"req_{i}",
+            "request": {
+                "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                "generationConfig": generation_config
+            }
+        })
+        for i, prompt in enumerate(prompts)
+    ]
+    try:
+        uploaded_file = await gemini_client.aio.files.upload(
+            file=io.BytesIO("\n".join(jsonl_lines).encode("utf-8")),
+            config=genai_types.UploadFileConfig(display_name=RECOMMENDATION_BATCH_DISPLAY_NAME, mime_type="jsonl")
+        )
+        batch_job = await gemini_client.aio.batches.create(
+            model=model_name,
+            src=uploaded_file.name,
+            config=genai_types.CreateBatchJobConfig(display_name=RECOMMENDATION_BATCH_DISPLAY_NAME)
+        )
+        logger.info("Submitted batch job %s with %s requests to model %s.", batch_job.name, len(prompts), model_name)
+        return batch_job
+    except Exception as e:
+        logger.error("Error submitting batch job to model %s: %s", model_name, e)
+        raise
+
+
+async def _get_batch_recommendations_from_llm(
+        job_name: str,
+        gemini_client: genai.Client,
+        products_by_id: Dict[str, Product]
+) -> Tuple[genai_types.BatchJob, List[Tuple[str, List[Product], str]]]:
+    """Fetches a Gemini Batch Mode job and, once it has succeeded, parses its results.
+
+    Args:
+        job_name: Name of the batch job (e.g. `batches/123`).
+        gemini_client: Initialized Gemini API client.
+        products_by_id: Product ID -> validated `Product` index.
+
+    Returns:
+        A tuple of the `BatchJob` and a list of `(key, products, message segment)`
+        tuples. The list is empty until the job has succeeded.
+
+    Raises:
+        HTTPException: 404 if the name is malformed or the job was not submitted by
+                       `_submit_batch_recommendations_to_llm`.
+    """
+    if not BATCH_JOB_NAME_PATTERN.fullmatch(job_name):
+        logger.warning("Rejected malformed batch job name: '%.80s'", job_name)
+        raise HTTPException(status_code=404, detail="Batch recommendation job not found.")
+    batch_job = await gemini_client.aio.batches.get(name=job_name)
+    if batch_job.display_name != RECOMMENDATION_BATCH_DISPLAY_NAME:
+        logger.warning("Batch job %s was not submitted as a recommendation batch.", job_name)
+        raise HTTPException(status_code=404, detail="Batch recommendation job not found.")
+    if batch_job.state != genai_types.JobState.JOB_STATE_SUCCEEDED or not batch_job.dest or not batch_job.dest.file_name:
+        return batch_job, []
+
+    results_bytes = await gemini_client.aio.files.download(file=batch_job.dest.file_name)
+    results = []
+    for line in results_bytes.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        key = result.get("key", "")
+        if "response" not in result:
+            logger.error("Batch job %s request %s failed: %s", job_name, key, result.get('error'))
+            results.append((key, [], " I wasn't able to process this query..."))
+            continue
+        llm_response_text = (genai_types.GenerateContentResponse.model_validate(result["response"]).text or "").strip()
+        results.append((key, *parse_llm_product_ids_and_fetch(llm_response_text, products_by_id)))
+    return batch_job, results
+
+
+def _identified_description(image_description: str) -> Optional[str]:
+    """Returns the description, or `None` if the vision model could not identify a product."""
+    if not image_description or "CANNOT IDENTIFY" in image_description.upper():
+        logger.info("Vision model could not identify a product in the image or returned an empty description.")
+        return None
+    return image_description
+
+
 async def _get_image_description_from_llm(
-        file: UploadFile,
+        image_bytes: bytes,
+        mime_type: str,
         gemini_client: genai.Client,
-        prompt_template: str,
-        model_name: str
+        prompt: str,
+        model_name: str,
+        service_tier: Optional[str] = None
 ) -> Optional[str]:
     """Reads an image file and gets its description from a Gemini vision model.
 
     Args:
-        file: Uploaded image file.
+        image_bytes: Contents of the uploaded image.
+        mime_type: MIME type of the uploaded image.
         gemini_client: Initialized Gemini API client.
-        prompt_template: Text prompt for the vision model.
+        prompt: Text prompt for the vision model.
         model_name: Name of the Gemini vision model.
+        service_tier: Optional Gemini service tier (e.g. "flex") for the request.
 
     Returns:
-        The image description string if successful.
-        Returns `None` if the file is empty, image cannot be identified,
-        a permission/API key error occurs, or any other error during processing.
+        The image description string, or `None` if the model cannot identify
+        a product in the image.
     """
-    contents = await file.read()
-    if not contents:
-        print(f"WARNING: Uploaded file {file.filename} is empty.")
-        raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    try:
+        image_part = genai_types.Part(inline_data=genai_types.Blob(mime_type=mime_type, data=image_bytes))
+        vision_model_payload = [prompt, image_part]
+        logger.debug("Sending image to vision model (%s) for description...", model_name)
+
+        vision_response = await gemini_client.aio.models.generate_content(
+            model=model_name,
+            contents=[vision_model_payload],
+            config=build_generation_config(service_tier=service_tier)
+        )
+        image_description = (vision_response.text or "").strip()
+        logger.debug("Vision model image description: '%s'", image_description)
+        return _identified_description(image_description)
+    except Exception as e:
+        if "PermissionDenied" in str(e) or "API key" in str(e):
+            logger.error("Gemini API permission or key error during image description: %s", e)
+            raise HTTPException(status_code=403, detail="Rufus: There seems to be an issue with API access for image processing.")
+        logger.error("Error during image description with model %s: %s", model_name, e)
+        raise
+
+
+async def _get_batched_image_descriptions_from_llm(
+        images: List[Tuple[bytes, str]],
+        gemini_client: genai.Client,
+        prompt: str,
+        model_name: str,
+        service_tier: Optional[str] = None
+) -> List[Optional[str]]:
+    """Describes several images in a single Gemini vision model call.
+
+    Args:
+        images: `(image bytes, MIME type)` pairs, numbered from 1 in the prompt.
+        gemini_client: Initialized Gemini API client.
+        prompt: Text prompt asking for one description per numbered image.
+        model_name: Name of the Gemini vision model.
+        service_tier: Optional Gemini service tier (e.g. "flex") for the request.
+
+    Returns:
+        One description per image, in order; `None` where the model could not
+        identify a product.
+    """
+    contents = [prompt]
+    for image_number, (image_bytes, mime_type) in enumerate(images, start=1):
+        contents.append(f"Image {image_number}:")
+        contents.append(genai_types.Part(inline_data=genai_types.Blob(mime_type=mime_type, data=image_bytes)))
+    logger.debug("Sending %s images to vision model (%s) for description...", len(images), model_name)
+
+    try:
+        vision_response = await gemini_client.aio.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=build_generation_config(
+                response_mime_type="application/json",
+                response_schema=list[LLMImageDescription],
+                service_tier=service_tier
+            )
+        )
+        logger.debug("Batched vision model response for %s images: '%s'", len(images), vision_response.text)
+        descriptions = {
+            entry.image_number: entry.description.strip()
+            for entry in map(LLMImageDescription.model_validate, orjson.loads(vision_response.text))
+        }
+        return [
+            _identified_description(descriptions.get(image_number, ""))
+            for image_number in range(1, len(images) + 1)
+        ]
+    except Exception as e:
+        if "PermissionDenied" in str(e) or "API key" in str(e):
+            logger.error("Gemini API permission or key error during image description: %s", e)
+            raise HTTPException(status_code=403, detail="Rufus: There seems to be an issue with API access for image processing.")
+        logger.error("Error during batched image description with model %s: %s", model_name, e)
+        raise
+
 
+async def _get_image_recommendations_from_llm(
+        image_bytes: bytes,
+        mime_type: str,
+        gemini_client: genai.Client,
+        prompt: str,
+        model_name: str,
+        products_by_id: Dict[str, Product],
+        cached_content: Optional[str] = None,
+        service_tier: Optional[str] = None
+) -> Optional[Tuple[str, List[Product], str]]:
+    """Sends an image and the catalog prompt to a Gemini vision model in a single call.
+
+    The model describes the product in the image and picks matching product IDs
+    in the same response. Used when the local product index is not available.
+
+    Args:
+        image_bytes: Contents of the uploaded image.
+        mime_type: MIME type of the uploaded image.
+        gemini_client: Initialized Gemini API client.
+        prompt: Text prompt containing the instructions and product context.
+        model_name: Name of the Gemini vision model.
+        products_by_id: Product ID -> validated `Product` index.
+        cached_content: Optional name of the cached catalog context to reference.
+        service_tier: Optional Gemini service tier (e.g. "flex") for the request.
+
+    Returns:
+        A tuple of the image description, a list of `Product` objects and a
+        message segment string. Returns `None` if the model cannot identify
+        a product in the image.
+    """
     try:
-        image_part = genai_types.Part(inline_data=genai_types.Blob(mime_type=file.content_type, data=contents))
-        vision_model_payload = [prompt_template, image_part]
-        print(f"DEBUG: Sending image to vision model ({model_name}) for description...")
+        image_part = genai_types.Part(inline_data=genai_types.Blob(mime_type=mime_type, data=image_bytes))
+        vision_model_payload = [prompt, image_part]
+        logger.debug("Sending image with product context to vision model (%s)...", model_name)
 
-        vision_response = gemini_client.models.generate_content(
+        vision_response = await gemini_client.aio.models.generate_content(
             model=model_name,
-            contents=[vision_model_payload]
+            contents=[vision_model_payload],
+            config=build_generation_config(
+                response_mime_type="application/json",
+                response_schema=LLMImageRecommendation,
+                cached_content=cached_content,
+                service_tier=service_tier
+            )
         )
-        image_description = vision_response.text.strip()
-        print(f"INFO: Vision model image description: '{image_description}'")
+        llm_response_text = (vision_response.text or "").strip()
+        logger.debug("Vision model response: '%s'", llm_response_text)
 
-        if not image_description or "CANNOT IDENTIFY" in image_description.upper():
-            print(f"INFO: Vision model could not identify a product in the image or returned an empty description.")
+        image_recommendation = LLMImageRecommendation.model_validate_json(llm_response_text) if llm_response_text else None
+        if image_recommendation is None or not image_recommendation.description.strip():
+            logger.info("Vision model could not identify a product in the image or returned an empty response.")
             return None
 
-        return image_description
+        recommended_products_details, message_segment = fetch_recommended_products(
+            image_recommendation.product_ids, products_by_id
+        )
+        return image_recommendation.description.strip(), recommended_products_details, message_segment
     except Exception as e:
         if "PermissionDenied" in str(e) or "API key" in str(e):
-            print(f"ERROR: Gemini API permission or key error during image description: {e}")
+            logger.error("Gemini API permission or key error during image recommendation: %s", e)
             raise HTTPException(status_code=403, detail="Rufus: There seems to be an issue with API access for image processing.")
-        print(f"ERROR: Error during image description with model {model_name}: {e}")
-        raise
\ No newline at end of file
+        logger.error("Error during image recommendation with model %s: %s", model_name, e)
+        raise